@@ -0,0 +1,54 @@
+"""Micro-benchmark of the JSON passes made per wizard query.
+
+Run from the workspace root:
+
+  python3 benchmarks/bench_json_codec.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src import agent as agent_mod
+
+WIZARDS = [
+    {
+        "id": f"w{i}",
+        "firstName": f"Wizard {i}",
+        "lastName": "Dumbledore",
+        "elixirs": [{"id": f"e{i}-{j}", "name": f"Elixir {j} of Wizard {i}"} for j in range(4)],
+    }
+    for i in range(5)
+]
+
+
+def query_round_trip(codec: agent_mod.JSONCodec, body: bytes) -> str:
+    """Decode the API body, encode the tool payload, re-parse it and pretty-print it."""
+    wizards = codec.loads(body)
+    payload = codec.dumps({"query": "Dumbledore", "potions": agent_mod._build_potions_list(wizards)})
+    codec.loads(payload)
+    return codec.dumps_pretty(codec.loads(payload))
+
+
+def main() -> None:
+    codecs = [agent_mod.JSONCodec()]
+    if agent_mod.orjson is not None:
+        codecs.append(agent_mod.OrjsonCodec())
+    else:
+        print("orjson not installed; only the stdlib backend is measured")
+
+    body = agent_mod.JSONCodec().dumps(WIZARDS).encode("utf-8")
+    number = 20000
+    baseline = None
+    for codec in codecs:
+        seconds = min(timeit.repeat(lambda: query_round_trip(codec, body), number=number, repeat=5))
+        per_call = seconds / number * 1e6
+        baseline = baseline or per_call
+        print(f"{codec.name:>7}: {per_call:7.2f} us/query  ({baseline / per_call:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
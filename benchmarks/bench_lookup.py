@@ -0,0 +1,86 @@
+"""End-to-end lookup latency benchmark against the local Wizard World stand-in.
+
+Runs queries through ``HybridAgent`` (with a no-op LLM fallback) and reports
+latency percentiles. Run from the workspace root:
+
+  python3 benchmarks/bench_lookup.py --latency lognormal:-2.5,0.8 --error-rate 0.02
+  python3 benchmarks/bench_lookup.py --api-base http://127.0.0.1:8000 --hedge
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src import agent as agent_mod
+from tests.wizard_api_stub import WizardAPIStub, load_fixture, parse_latency
+
+
+class NullLLMAgent:
+    def run(self, query: str) -> str:
+        return ""
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def run(base_url: str, args: argparse.Namespace) -> None:
+    client = agent_mod.WizardClient(
+        base_url=base_url,
+        cache=agent_mod.LookupCache() if args.cache else None,
+        hedge=agent_mod.HedgePolicy() if args.hedge else None,
+    )
+    agent = agent_mod.HybridAgent(NullLLMAgent(), client)
+    names = [w["lastName"] for w in load_fixture()["wizards"]] + ["What is 12 * 7?"]
+    rng = random.Random(args.seed)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        query = rng.choice(names)
+        t0 = time.perf_counter()
+        agent.run(query)
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - started
+
+    ms = [s * 1000 for s in latencies]
+    print(f"requests: {args.requests}  throughput: {args.requests / total:.1f}/s")
+    print(
+        f"latency ms  mean {statistics.mean(ms):.2f}  p50 {percentile(ms, 50):.2f}"
+        f"  p95 {percentile(ms, 95):.2f}  p99 {percentile(ms, 99):.2f}  max {max(ms):.2f}"
+    )
+    print(f"metrics: {client.metrics()}")
+    client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api-base", help="Benchmark an already running server instead of the stub")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency", default="lognormal:-4,0.6", help="Stub latency spec")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--cache", action="store_true", help="Enable the in-memory lookup cache")
+    parser.add_argument("--hedge", action="store_true", help="Enable request hedging")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.api_base:
+        run(args.api_base, args)
+        return
+
+    rng = random.Random(args.seed)
+    with WizardAPIStub(
+        latency=parse_latency(args.latency, rng), error_rate=args.error_rate, seed=args.seed
+    ) as stub:
+        run(stub.base_url, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,22 +9,91 @@ Usage:
 """
 
 import argparse
+import asyncio
+import codecs
+import difflib
+import gzip
+import hashlib
 import json
 import logging
+import math
 import os
+import random
+import sqlite3
+import sys
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Any
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Iterator, Optional, Union
+from urllib.parse import quote, urlencode
 
 import requests
-from langchain.tools import tool
-from urllib.parse import urlencode
+from langchain_core.tools import StructuredTool
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON backend
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 # Constants
-WIZARD_API_BASE = "https://wizard-world-api.herokuapp.com"
+WIZARD_API_BASE = os.environ.get("WIZARD_API_BASE", "https://wizard-world-api.herokuapp.com")
 WIZARD_API_TIMEOUT = 8
 MAX_WIZARD_RESULTS = 5
+WIZARD_POOL_SIZE = 10
+LOOKUP_CACHE_TTL = 300.0
+LOOKUP_CACHE_MAX_ENTRIES = 1024
+LOOKUP_CACHE_MAX_BYTES = 4 * 1024 * 1024
+STALE_WHILE_REVALIDATE = 60.0
+STALE_IF_ERROR = 24 * 60 * 60.0
+NEGATIVE_CACHE_TTL = 60.0
+NEGATIVE_CACHE_MAX_ENTRIES = 4096
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+DISK_CACHE_TTL = 24 * 60 * 60.0
+DISK_CACHE_MAX_BYTES = 32 * 1024 * 1024
+LOOKUP_MANY_CONCURRENCY = 8
+HYDRATE_CONCURRENCY = 8
+ELIXIR_CACHE_TTL = 60 * 60.0
+ELIXIR_CACHE_MAX_ENTRIES = 4096
+ELIXIR_MISS_TTL = 60.0
+POTION_INTERN_MAX_ENTRIES = 4096
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+LATENCY_WINDOW = 200
+HEDGE_PERCENTILE = 95.0
+HEDGE_MAX_RATIO = 0.1
+HEDGE_MIN_SAMPLES = 20
+CONNECT_TIMEOUT_FLOOR = 0.5
+CONNECT_TIMEOUT_CEILING = float(WIZARD_API_TIMEOUT)
+READ_TIMEOUT_FLOOR = 1.0
+READ_TIMEOUT_CEILING = 30.0
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 2.0
+RETRY_BUDGET_RATIO = 0.1
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+STREAM_CHUNK_SIZE = 8192
+RATE_LIMIT_PER_SECOND = 10.0
+RATE_LIMIT_BURST = 20
+FUZZY_TOP_K = 3
+FUZZY_MIN_SCORE = 0.75
+DEFAULT_CACHE_DIR = os.environ.get(
+    "WIZARD_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "wizard-agent")
+)
+SNAPSHOT_FILENAME = "snapshot.json.gz"
+WIZARD_DB_FILENAME = "wizards.sqlite3"
+WIZARD_SOURCE = os.environ.get("WIZARD_SOURCE", "http")
+WIZARD_SOURCES = ("http", "snapshot", "sqlite", "fixture")
+WIZARD_JSON_BACKEND = os.environ.get("WIZARD_JSON_BACKEND", "auto")
+JSON_BACKENDS = ("auto", "orjson", "json")
+QUERY_LOG_FILENAME = "queries.log"
+QUERY_LOG_MAX_BYTES = 1024 * 1024
+WARMUP_TOP_N = 20
+WARMUP_CONNECTIONS = 4
 
 
 class WizardLookupError(Exception):
@@ -33,6 +102,125 @@ class WizardLookupError(Exception):
     pass
 
 
+class CircuitOpenError(WizardLookupError):
+    """Raised when the circuit breaker rejects a call without contacting the API."""
+
+    pass
+
+
+class DeadlineExceededError(WizardLookupError):
+    """Raised when the caller's deadline leaves no time for another request."""
+
+    pass
+
+
+class JSONCodec:
+    """Standard-library JSON encoding used throughout the lookup path.
+
+    ``dumps`` emits compact UTF-8 text (no ASCII escaping, no spaces) and
+    ``dumps_pretty`` two-space indented text, so every backend can produce
+    byte-identical output.
+    """
+
+    name = "json"
+
+    def loads(self, data: Any) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+    def dumps_pretty(self, obj: Any) -> str:
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=_json_default)
+
+
+class OrjsonCodec(JSONCodec):
+    """``orjson``-backed codec producing the same bytes as ``JSONCodec``.
+
+    orjson formats small floats differently (``1e-7`` vs ``1e-07``), so
+    values containing floats are encoded by the stdlib, as are values orjson
+    rejects (non-string keys, integers beyond 64 bits). Decoding falls back
+    the same way: orjson reads integers beyond 64 bits as floats and rejects
+    ``NaN``, ``Infinity`` and out-of-range numbers, which the stdlib accepts.
+    Lookup payloads are all strings and take the fast path.
+    """
+
+    name = "orjson"
+
+    def loads(self, data: Any) -> Any:
+        try:
+            value = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return super().loads(data)
+        if _contains_float(value):
+            return super().loads(data)
+        return value
+
+    def dumps(self, obj: Any) -> str:
+        if not _contains_float(obj):
+            try:
+                return orjson.dumps(obj, default=_json_default).decode("utf-8")
+            except TypeError:
+                pass
+        return super().dumps(obj)
+
+    def dumps_pretty(self, obj: Any) -> str:
+        if not _contains_float(obj):
+            try:
+                return orjson.dumps(obj, default=_json_default, option=orjson.OPT_INDENT_2).decode("utf-8")
+            except TypeError:
+                pass
+        return super().dumps_pretty(obj)
+
+
+def _json_default(obj: Any) -> Any:
+    """Encode result objects (``LookupResult``, ``PotionEntry``) through their ``to_dict``."""
+    if isinstance(obj, (LookupResult, PotionEntry)):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _contains_float(obj: Any) -> bool:
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        kind = type(item)
+        if kind is dict:
+            stack.extend(item.values())
+        elif kind is list or kind is tuple:
+            stack.extend(item)
+        elif kind is float:
+            return True
+    return False
+
+
+_json_codec: JSONCodec = OrjsonCodec() if orjson is not None else JSONCodec()
+
+
+def set_json_backend(name: str) -> JSONCodec:
+    """Select the JSON backend: ``orjson``, ``json`` or ``auto`` (fastest installed)."""
+    global _json_codec
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise RuntimeError("orjson is not installed. Install it with: pip install orjson")
+        _json_codec = OrjsonCodec()
+    elif name == "json":
+        _json_codec = JSONCodec()
+    else:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    return _json_codec
+
+
+def _json_loads(data: Any) -> Any:
+    return _json_codec.loads(data)
+
+
+def _json_dumps(obj: Any) -> str:
+    return _json_codec.dumps(obj)
+
+
 def _extract_wizard_info(wizard_data: dict) -> dict:
     """Extract name and potions from wizard API response."""
     name = wizard_data.get("name") or wizard_data.get("firstName") or str(wizard_data)
@@ -40,12 +228,2596 @@ def _extract_wizard_info(wizard_data: dict) -> dict:
     return {"name": name, "potions": potions}
 
 
-def _format_potion(potion: dict) -> dict:
-    """Format a single potion result."""
-    return {
-        "potion_name": potion.get("name") or potion.get("title") or "Unknown",
-        "potion_description": potion.get("effect") or potion.get("description") or "",
-    }
+def _elixir_ids(wizards: list) -> list:
+    """Unique ids of elixirs referenced without details by the first MAX_WIZARD_RESULTS wizards."""
+    ids = {}
+    for wizard in wizards[:MAX_WIZARD_RESULTS]:
+        for potion in _extract_wizard_info(wizard)["potions"]:
+            if isinstance(potion, dict) and potion.get("id") and not potion.get("effect"):
+                ids[potion["id"]] = None
+    return list(ids)
+
+
+def _format_potion(potion: dict) -> "PotionRecord":
+    """Format a single potion result as a shared record."""
+    return PotionRecord.intern(
+        potion.get("id"),
+        potion.get("name") or potion.get("title") or "Unknown",
+        potion.get("effect") or potion.get("description") or "",
+    )
+
+
+def _build_potions_list(wizards: list, elixir_details: Optional[dict] = None) -> list:
+    """Flatten the first MAX_WIZARD_RESULTS wizards into ``PotionEntry`` rows.
+
+    ``elixir_details`` maps elixir id to its ``/elixirs/{id}`` record and is
+    merged into the ``{id, name}`` references before formatting.
+    """
+    potions_list = []
+    for wizard in wizards[:MAX_WIZARD_RESULTS]:
+        wizard_info = _extract_wizard_info(wizard)
+        for potion in wizard_info["potions"]:
+            if elixir_details and potion.get("id") in elixir_details:
+                potion = {**potion, **elixir_details[potion["id"]]}
+            potions_list.append(PotionEntry(sys.intern(wizard_info["name"]), _format_potion(potion)))
+    return potions_list
+
+
+def _normalize_query(query: str) -> str:
+    """Normalize a query for use as a cache key (collapse whitespace, casefold)."""
+    return " ".join(query.split()).casefold()
+
+
+class PotionRecord:
+    """Immutable potion details shared by every result row that references them.
+
+    ``intern`` returns the existing record for equal details instead of a
+    new one, so a potion repeated across wizards, results and cache entries
+    is stored once, with interned strings. The intern table holds up to
+    ``POTION_INTERN_MAX_ENTRIES`` records (far more than the catalog has)
+    and starts over when full.
+    """
+
+    __slots__ = ("id", "name", "description")
+
+    _interned: dict = {}
+
+    def __init__(self, potion_id: Optional[str], name: str, description: str = ""):
+        object.__setattr__(self, "id", potion_id)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "description", description)
+
+    @classmethod
+    def intern(cls, potion_id: Optional[str], name: str, description: str = "") -> "PotionRecord":
+        """Return the shared record for these details, creating it if needed."""
+        key = (potion_id, name, description)
+        record = cls._interned.get(key)
+        if record is None:
+            if len(cls._interned) >= POTION_INTERN_MAX_ENTRIES:
+                cls._interned.clear()
+            record = cls(sys.intern(potion_id) if potion_id else None, sys.intern(name), sys.intern(description))
+            # setdefault is atomic, so racing threads still end up sharing one record
+            record = cls._interned.setdefault(key, record)
+        return record
+
+    @property
+    def key(self) -> str:
+        """Identifier in grouped output: the elixir id, or the name if the API gave none."""
+        return self.id or self.name
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _fields(self) -> tuple:
+        return (self.id, self.name, self.description)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, PotionRecord):
+            return NotImplemented
+        return self is other or self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        return hash(self._fields())
+
+    def __repr__(self) -> str:
+        return f"PotionRecord({self.id!r}, {self.name!r}, {self.description!r})"
+
+
+class PotionEntry:
+    """One potion row of a lookup result: a wizard and a shared ``PotionRecord``."""
+
+    __slots__ = ("wizard", "potion")
+
+    def __init__(self, wizard: str, potion: PotionRecord):
+        object.__setattr__(self, "wizard", wizard)
+        object.__setattr__(self, "potion", potion)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PotionEntry":
+        return cls(
+            sys.intern(data["wizard"]),
+            PotionRecord.intern(data.get("potion_id"), data["potion_name"], data.get("potion_description", "")),
+        )
+
+    @property
+    def potion_name(self) -> str:
+        return self.potion.name
+
+    @property
+    def potion_description(self) -> str:
+        return self.potion.description
+
+    def to_dict(self, with_id: bool = False) -> dict:
+        """Return the flat row; ``with_id`` adds ``potion_id`` (kept in the disk cache)."""
+        data = {
+            "wizard": self.wizard,
+            "potion_name": self.potion.name,
+            "potion_description": self.potion.description,
+        }
+        if with_id and self.potion.id:
+            data["potion_id"] = self.potion.id
+        return data
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, PotionEntry):
+            return NotImplemented
+        return self.wizard == other.wizard and self.potion == other.potion
+
+    def __hash__(self) -> int:
+        return hash((self.wizard, self.potion))
+
+    def __repr__(self) -> str:
+        return f"PotionEntry({self.wizard!r}, {self.potion!r})"
+
+
+class LookupResult:
+    """Outcome of a wizard lookup, serialized only at the CLI and tool boundaries.
+
+    ``stale`` marks results served from an expired cache entry, and
+    ``fuzzy`` results list the ``matched`` wizards that stood in for a
+    misspelled query.
+    """
+
+    __slots__ = ("query", "potions", "error", "stale", "fuzzy", "matched")
+
+    def __init__(
+        self,
+        query: str,
+        potions: list = (),
+        error: Optional[str] = None,
+        stale: bool = False,
+        fuzzy: bool = False,
+        matched: Optional[list] = None,
+    ):
+        self.query = query
+        self.potions = potions
+        self.error = error
+        self.stale = stale
+        self.fuzzy = fuzzy
+        self.matched = matched
+
+    def to_dict(self, grouped: bool = False) -> dict:
+        """Return the JSON-ready ``{"query", "potions", ...}`` payload.
+
+        The default lists one flat row per wizard and potion. ``grouped``
+        instead maps each wizard to potion keys under ``wizards`` and lists
+        every distinct potion once in a ``potions`` table, which is much
+        smaller for broad queries where the same elixirs repeat.
+        """
+        if grouped:
+            wizards: dict = {}
+            table: dict = {}
+            for entry in self.potions:
+                potion = entry.potion
+                wizards.setdefault(entry.wizard, []).append(potion.key)
+                table.setdefault(potion.key, {"name": potion.name, "description": potion.description})
+            data = {"query": self.query, "wizards": wizards, "potions": table}
+        else:
+            data = {"query": self.query, "potions": [potion.to_dict() for potion in self.potions]}
+        if self.stale:
+            data["stale"] = True
+        if self.fuzzy:
+            data["fuzzy"] = True
+            data["matched"] = self.matched
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+    def to_json(self, grouped: bool = False) -> str:
+        return _json_dumps(self.to_dict(grouped))
+
+    def __repr__(self) -> str:
+        return f"LookupResult({self.to_dict()!r})"
+
+
+def _empty_query_result() -> LookupResult:
+    return LookupResult("", error="Please provide a search query")
+
+
+_POTION_ROW_JSON_OVERHEAD = len('{"wizard":"","potion_name":"","potion_description":""},')
+
+
+def _approx_json_size(value: Any) -> int:
+    """Estimate the encoded JSON size of ``value`` without encoding it.
+
+    Strings count their characters plus quotes and a separator, other
+    scalars a flat 8, and ``PotionEntry`` rows the lengths of their (shared,
+    interned) fields plus the row's keys and punctuation.
+    """
+    size = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        kind = type(item)
+        if kind is str:
+            size += len(item) + 3
+        elif kind is PotionEntry:
+            potion = item.potion
+            size += _POTION_ROW_JSON_OVERHEAD + len(item.wizard) + len(potion.name) + len(potion.description)
+        elif kind is dict:
+            size += 2
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif kind is list or kind is tuple:
+            size += 2
+            stack.extend(item)
+        else:
+            size += 8
+    return size
+
+
+class LookupCache:
+    """Thread-safe in-memory LRU cache with per-entry TTL.
+
+    Bounded both by entry count and by the approximate serialized size of the
+    cached values (estimated by ``_approx_json_size``, not by encoding them). Expired entries are kept for a further ``stale_ttl``
+    seconds so ``get_stale`` can serve them, then dropped lazily on access
+    and when making room for new ones.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = LOOKUP_CACHE_MAX_ENTRIES,
+        max_bytes: int = LOOKUP_CACHE_MAX_BYTES,
+        ttl: float = LOOKUP_CACHE_TTL,
+        clock: Any = time.monotonic,
+        stale_ttl: float = 0.0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for ``key``, or None if missing or expired."""
+        entry = self.get_stale(key, allow_stale=False)
+        return None if entry is None else entry[0]
+
+    def get_stale(self, key: str, allow_stale: bool = True) -> Optional[tuple]:
+        """Return ``(value, stale_for)`` for ``key``, or None.
+
+        ``stale_for`` is how many seconds ago the entry expired (negative
+        while it is fresh). Expired entries are only returned with
+        ``allow_stale`` and within ``stale_ttl`` of expiry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _size = entry
+            stale_for = self._clock() - expires_at
+            if stale_for >= self.stale_ttl:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if stale_for >= 0 and not allow_stale:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if stale_for >= 0:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return value, stale_for
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store ``value`` under ``key``, evicting least recently used entries."""
+        size = _approx_json_size(value)
+        if size > self.max_bytes:
+            return
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _value, _expires_at, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def delete(self, key: str) -> None:
+        """Drop ``key`` if present."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        """Drop all entries (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss/eviction counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "stale_hits": self.stale_hits,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskLookupCache:
+    """SQLite-backed lookup cache shared between CLI invocations.
+
+    Uses WAL journaling and a busy timeout so several processes can read and
+    write the same file concurrently. Each thread gets its own connection.
+    Expired rows stay readable through ``get_stale`` for ``stale_ttl``
+    seconds. When the stored values exceed ``max_bytes``, rows past that
+    window are purged first and then the least recently accessed ones.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = DISK_CACHE_TTL,
+        max_bytes: int = DISK_CACHE_MAX_BYTES,
+        clock: Any = time.time,
+        stale_ttl: float = 0.0,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._local = threading.local()
+        self._connections: list = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookups ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " size INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS lookups_accessed ON lookups (accessed_at)")
+
+    @classmethod
+    def in_dir(cls, cache_dir: str, **kwargs: Any) -> "DiskLookupCache":
+        """Open the cache file inside ``cache_dir``."""
+        return cls(os.path.join(cache_dir, "lookups.sqlite3"), **kwargs)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for ``key``, or None if missing or expired."""
+        entry = self.get_stale(key, allow_stale=False)
+        return None if entry is None else entry[0]
+
+    def get_stale(self, key: str, allow_stale: bool = True) -> Optional[tuple]:
+        """Return ``(value, stale_for)`` like ``LookupCache.get_stale``."""
+        conn = self._connect()
+        now = self._clock()
+        row = conn.execute("SELECT value, expires_at FROM lookups WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        stale_for = now - row[1]
+        if stale_for >= self.stale_ttl or (stale_for >= 0 and not allow_stale):
+            self.misses += 1
+            return None
+        conn.execute("UPDATE lookups SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return _json_loads(row[0]), stale_for
+
+    def delete(self, key: str) -> None:
+        """Drop ``key`` if present."""
+        self._connect().execute("DELETE FROM lookups WHERE key = ?", (key,))
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store ``value`` under ``key`` and trim the file back under ``max_bytes``."""
+        text = _json_dumps(value)
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = self._clock()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO lookups (key, value, expires_at, accessed_at, size)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, text, expires_at, now, size),
+            )
+            self._prune(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM lookups").fetchone()
+        if total <= self.max_bytes:
+            return
+        conn.execute("DELETE FROM lookups WHERE expires_at <= ?", (now - self.stale_ttl,))
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM lookups").fetchone()
+        rows = conn.execute("SELECT key, size FROM lookups ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM lookups WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self) -> None:
+        """Delete all entries."""
+        self._connect().execute("DELETE FROM lookups")
+
+    def stats(self) -> dict:
+        """Return hit/miss counters for this process and the on-disk size."""
+        entries, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM lookups"
+        ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
+
+    def close(self) -> None:
+        """Close every connection opened by this cache."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class QueryLog:
+    """Append-only file of successful lookup queries, one normalized query per line.
+
+    ``top`` reads it back to pick the queries to prewarm on startup. Once the
+    file grows past ``max_bytes`` only its newest half is kept.
+    """
+
+    def __init__(self, path: str, max_bytes: int = QUERY_LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @classmethod
+    def in_dir(cls, cache_dir: str, scope: str, **kwargs: Any) -> "QueryLog":
+        """Open the log for ``scope`` (see ``WizardSource.scope``) inside ``cache_dir``.
+
+        Each API or catalog gets its own file, so queries that were popular
+        against one are not prewarmed against another.
+        """
+        digest = hashlib.blake2b(scope.encode("utf-8"), digest_size=6).hexdigest()
+        stem, ext = os.path.splitext(QUERY_LOG_FILENAME)
+        return cls(os.path.join(cache_dir, f"{stem}-{digest}{ext}"), **kwargs)
+
+    def record(self, query: str) -> None:
+        """Append ``query`` to the log."""
+        line = _normalize_query(query)
+        if not line:
+            return
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                    size = f.tell()
+                if size > self.max_bytes:
+                    self._compact()
+            except OSError as e:
+                logger.warning(f"Failed to write query log: {e}")
+
+    def _compact(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.readlines()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines[len(lines) // 2:])
+        os.replace(tmp_path, self.path)
+
+    def top(self, n: int = WARMUP_TOP_N) -> list:
+        """Return the ``n`` most frequent logged queries, most frequent first."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                counts = Counter(line.rstrip("\n") for line in f if line.strip())
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            logger.warning(f"Failed to read query log: {e}")
+            return []
+        return [query for query, _ in counts.most_common(n)]
+
+
+def _wizard_matches(wizard: dict, needle: str) -> bool:
+    """Mirror the API's ``name`` filter: case-insensitive substring of first or last name."""
+    for field in ("firstName", "lastName"):
+        value = wizard.get(field)
+        if value and needle in value.casefold():
+            return True
+    return False
+
+
+class WizardNameIndex:
+    """N-gram postings index over wizard first and last names.
+
+    Every substring of length 1..``NGRAM`` of each (casefolded) name is
+    indexed, so short queries are a single postings lookup. Longer queries
+    intersect the postings of their n-grams and verify the survivors, which
+    yields exactly the records ``_wizard_matches`` would accept.
+    """
+
+    NGRAM = 3
+
+    def __init__(self, wizards: list):
+        self.wizards = wizards
+        self._postings: dict = {}
+        for position, wizard in enumerate(wizards):
+            for field in ("firstName", "lastName"):
+                value = wizard.get(field)
+                if value:
+                    self._add(value.casefold(), position)
+
+    def _add(self, name: str, position: int) -> None:
+        for gram in _ngrams(name, self.NGRAM):
+            self._postings.setdefault(gram, set()).add(position)
+
+    def search(self, query: str) -> list:
+        """Return wizards whose first or last name contains ``query``, in catalog order."""
+        needle = query.casefold()
+        if not needle:
+            return list(self.wizards)
+        if len(needle) <= self.NGRAM:
+            positions = self._postings.get(needle, ())
+        else:
+            grams = {needle[i:i + self.NGRAM] for i in range(len(needle) - self.NGRAM + 1)}
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            positions = set(postings[0]).intersection(*postings[1:])
+            positions = [p for p in positions if _wizard_matches(self.wizards[p], needle)]
+        return [self.wizards[p] for p in sorted(positions)]
+
+
+class NameBloomFilter:
+    """Bloom filter over the name n-grams of a wizard catalog.
+
+    Holds every 1..``NGRAM`` character substring of each first and last name.
+    A query with an n-gram missing from the filter cannot be a substring of
+    any catalog name, so it is definitely not a wizard and needs no API call.
+    False positives only cost the round trip that would have happened anyway.
+    Names added upstream after the catalog was built are not known to it, so
+    rebuild it whenever the snapshot is refreshed.
+    """
+
+    NGRAM = WizardNameIndex.NGRAM
+
+    def __init__(self, capacity: int, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.rejected = 0
+
+    @classmethod
+    def from_wizards(cls, wizards: list, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE) -> "NameBloomFilter":
+        grams = set()
+        for wizard in wizards:
+            for field in ("firstName", "lastName"):
+                value = wizard.get(field)
+                if value:
+                    grams.update(_ngrams(value.casefold(), cls.NGRAM))
+        bloom = cls(len(grams), false_positive_rate)
+        for gram in grams:
+            bloom.add(gram)
+        return bloom
+
+    def _positions(self, item: str) -> list:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def might_match(self, query: str) -> bool:
+        """False only if no catalog name can contain ``query``."""
+        needle = query.casefold()
+        if len(needle) <= self.NGRAM:
+            grams = [needle]
+        else:
+            grams = {needle[i:i + self.NGRAM] for i in range(len(needle) - self.NGRAM + 1)}
+        if all(gram in self for gram in grams):
+            return True
+        self.rejected += 1
+        return False
+
+
+def _ngrams(text: str, n: int) -> set:
+    """All substrings of ``text`` of length 1..n."""
+    return {text[i:i + size] for size in range(1, n + 1) for i in range(len(text) - size + 1)}
+
+
+class FuzzyNameIndex:
+    """Typo-tolerant wizard name matching.
+
+    Candidates sharing at least one padded trigram with the query are scored
+    with ``difflib`` similarity against the first name, last name and full
+    name; the best ``top_k`` at or above ``min_score`` are returned.
+    """
+
+    def __init__(self, wizards: list, top_k: int = FUZZY_TOP_K, min_score: float = FUZZY_MIN_SCORE):
+        self.wizards = wizards
+        self.top_k = top_k
+        self.min_score = min_score
+        self._names: list = []
+        self._postings: dict = {}
+        for position, wizard in enumerate(wizards):
+            parts = [wizard.get(field) for field in ("firstName", "lastName") if wizard.get(field)]
+            names = {part.casefold() for part in parts}
+            if len(parts) > 1:
+                names.add(" ".join(parts).casefold())
+            self._names.append(names)
+            for name in names:
+                for gram in self._trigrams(name):
+                    self._postings.setdefault(gram, set()).add(position)
+
+    @staticmethod
+    def _trigrams(text: str) -> set:
+        padded = f"  {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def search(self, query: str) -> list:
+        """Return up to ``top_k`` ``(score, wizard)`` pairs, best first."""
+        needle = " ".join(query.split()).casefold()
+        if not needle:
+            return []
+        candidates = set()
+        for gram in self._trigrams(needle):
+            candidates.update(self._postings.get(gram, ()))
+
+        scored = []
+        for position in candidates:
+            score = max(
+                difflib.SequenceMatcher(None, needle, name).ratio() for name in self._names[position]
+            )
+            if score >= self.min_score:
+                scored.append((score, position))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, self.wizards[position]) for score, position in scored[: self.top_k]]
+
+
+class WizardSnapshot:
+    """Local copy of the full Wizard World catalog (all wizards and elixirs).
+
+    Stored as gzip-compressed compact JSON and answered entirely from memory,
+    so lookups need no per-query HTTP request.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, wizards: list, elixirs: list, fetched_at: Optional[float] = None):
+        self.wizards = wizards
+        self.elixirs = elixirs
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.name_index = WizardNameIndex(wizards)
+        self.elixirs_by_id = {elixir["id"]: elixir for elixir in elixirs if elixir.get("id")}
+
+    @classmethod
+    def download(cls, client: "WizardClient") -> "WizardSnapshot":
+        """Fetch every wizard and elixir from the API."""
+        wizards = client.get_json("/wizards") or []
+        elixirs = client.get_json("/elixirs") or []
+        return cls(wizards, elixirs)
+
+    @classmethod
+    def load(cls, path: str) -> "WizardSnapshot":
+        """Read a snapshot written by ``save``."""
+        with gzip.open(path, "rb") as f:
+            data = _json_loads(f.read())
+        if data.get("version") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version in {path}: {data.get('version')}")
+        return cls(data["wizards"], data["elixirs"], data["fetched_at"])
+
+    def save(self, path: str) -> None:
+        """Atomically write the snapshot to ``path``."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        data = {
+            "version": self.FORMAT_VERSION,
+            "fetched_at": self.fetched_at,
+            "wizards": self.wizards,
+            "elixirs": self.elixirs,
+        }
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(_json_dumps(data).encode("utf-8"))
+        os.replace(tmp_path, path)
+
+    def find_wizards(self, query: str) -> list:
+        """Return wizards matching ``query`` the same way the remote filter does."""
+        return self.name_index.search(query)
+
+
+class WizardSource(ABC):
+    """Backend answering wizard name searches and elixir lookups.
+
+    ``WizardClient`` layers caching, request coalescing, fuzzy matching and
+    hydration on top of a source, so backends can be swapped without
+    touching ``HybridAgent`` or the ``wizard_lookup`` tool.
+    """
+
+    #: Whether calls go over the network, so connections are worth prewarming.
+    remote = False
+
+    @property
+    def scope(self) -> str:
+        """Identity of the data behind this source; cache keys and query logs are scoped by it."""
+        return type(self).__name__
+
+    @abstractmethod
+    def search_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        """Return up to ``MAX_WIZARD_RESULTS`` wizards whose first or last name contains ``name``."""
+
+    @abstractmethod
+    def get_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        """Return the elixir record for ``elixir_id``, or None if it is unknown."""
+
+    def iter_wizards(self, name: str, deadline: Optional[float] = None) -> Iterator[dict]:
+        """Yield the ``search_wizards`` results one at a time, as soon as each is available."""
+        yield from self.search_wizards(name, deadline)
+
+    def catalog(self) -> Optional[list]:
+        """Return every wizard if the source holds the catalog locally, else None."""
+        return None
+
+    async def asearch_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        """Async variant of ``search_wizards``; runs it in a worker thread by default."""
+        return await asyncio.to_thread(self.search_wizards, name, deadline)
+
+    async def aget_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        """Async variant of ``get_elixir``; runs it in a worker thread by default."""
+        return await asyncio.to_thread(self.get_elixir, elixir_id, deadline)
+
+    def close(self) -> None:
+        """Release resources held by the source."""
+
+
+class InMemoryWizardSource(WizardSource):
+    """Source backed by in-memory wizard and elixir lists, e.g. a test fixture."""
+
+    def __init__(self, wizards: list, elixirs: list = ()):
+        self.wizards = list(wizards)
+        self.elixirs_by_id = {elixir["id"]: elixir for elixir in elixirs if elixir.get("id")}
+
+    @classmethod
+    def from_file(cls, path: str) -> "InMemoryWizardSource":
+        """Load a ``{"wizards": [...], "elixirs": [...]}`` JSON file."""
+        with open(path, "rb") as f:
+            data = _json_loads(f.read())
+        return cls(data.get("wizards") or [], data.get("elixirs") or [])
+
+    def search_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        needle = name.strip().casefold()
+        return [wizard for wizard in self.wizards if _wizard_matches(wizard, needle)][:MAX_WIZARD_RESULTS]
+
+    def get_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        return self.elixirs_by_id.get(elixir_id)
+
+    def catalog(self) -> Optional[list]:
+        return self.wizards
+
+    async def asearch_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        return self.search_wizards(name, deadline)
+
+    async def aget_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        return self.get_elixir(elixir_id, deadline)
+
+
+class SnapshotWizardSource(InMemoryWizardSource):
+    """Source answering from a ``WizardSnapshot`` through its n-gram name index."""
+
+    def __init__(self, snapshot: WizardSnapshot):
+        self.snapshot = snapshot
+        self.wizards = snapshot.wizards
+        self.elixirs_by_id = snapshot.elixirs_by_id
+
+    def search_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        return self.snapshot.find_wizards(name)[:MAX_WIZARD_RESULTS]
+
+
+class SQLiteWizardSource(WizardSource):
+    """Source backed by a SQLite copy of the catalog.
+
+    Unlike a snapshot the catalog is not loaded into memory; name searches
+    run against case-folded name columns. Populate it with ``import_snapshot``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS wizards ("
+            " id TEXT PRIMARY KEY,"
+            " first_name TEXT NOT NULL,"
+            " last_name TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS elixirs (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    @classmethod
+    def in_dir(cls, cache_dir: str) -> "SQLiteWizardSource":
+        """Open the catalog database inside ``cache_dir``."""
+        return cls(os.path.join(cache_dir, WIZARD_DB_FILENAME))
+
+    @property
+    def scope(self) -> str:
+        return f"sqlite:{os.path.abspath(self.path)}"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def import_snapshot(self, snapshot: WizardSnapshot) -> None:
+        """Replace the stored catalog with the contents of ``snapshot``."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM wizards")
+            conn.execute("DELETE FROM elixirs")
+            conn.executemany(
+                "INSERT OR REPLACE INTO wizards (id, first_name, last_name, data) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        wizard.get("id") or str(position),
+                        (wizard.get("firstName") or "").casefold(),
+                        (wizard.get("lastName") or "").casefold(),
+                        _json_dumps(wizard),
+                    )
+                    for position, wizard in enumerate(snapshot.wizards)
+                ],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO elixirs (id, data) VALUES (?, ?)",
+                [(elixir_id, _json_dumps(elixir)) for elixir_id, elixir in snapshot.elixirs_by_id.items()],
+            )
+
+    def search_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        needle = name.strip().casefold()
+        try:
+            rows = self._connect().execute(
+                "SELECT data FROM wizards WHERE instr(first_name, ?) OR instr(last_name, ?)"
+                " ORDER BY rowid LIMIT ?",
+                (needle, needle, MAX_WIZARD_RESULTS),
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise WizardLookupError(f"wizard database unavailable: {e}") from e
+        return [_json_loads(data) for (data,) in rows]
+
+    def get_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        try:
+            row = self._connect().execute("SELECT data FROM elixirs WHERE id = ?", (elixir_id,)).fetchone()
+        except sqlite3.Error as e:
+            raise WizardLookupError(f"wizard database unavailable: {e}") from e
+        return None if row is None else _json_loads(row[0])
+
+    def catalog(self) -> Optional[list]:
+        try:
+            rows = self._connect().execute("SELECT data FROM wizards ORDER BY rowid").fetchall()
+        except sqlite3.Error as e:
+            raise WizardLookupError(f"wizard database unavailable: {e}") from e
+        return [_json_loads(data) for (data,) in rows]
+
+    def close(self) -> None:
+        """Close every connection opened by this source."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class CircuitBreaker:
+    """Fail fast while the Wizard API is down.
+
+    Opens after ``failure_threshold`` consecutive failures (errors, timeouts or
+    5xx responses). While open every call is rejected with ``CircuitOpenError``
+    until ``reset_timeout`` has passed; then up to ``half_open_max_calls``
+    probes are let through, and the first result decides whether the circuit
+    closes again or re-opens.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+        half_open_max_calls: int = 1,
+        clock: Any = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        """Current state: ``closed``, ``open`` or ``half_open``."""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def before_call(self) -> None:
+        """Reserve a call slot or raise ``CircuitOpenError``."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+        raise CircuitOpenError(f"Wizard API circuit is open; retrying in {retry_in:.1f}s")
+
+    def release(self) -> None:
+        """Give back a slot from ``before_call`` whose outcome will never be recorded."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self.opened += 1
+
+    def stats(self) -> dict:
+        """Return the state and counters."""
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyTracker:
+    """Rolling window of recent successful request latencies (seconds)."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Nearest-rank percentile of the window, or None when empty."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = max(1, min(len(samples), round(p / 100 * len(samples) + 0.5)))
+        return samples[rank - 1]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class AdaptiveTimeout:
+    """Latency-aware connect and read timeouts.
+
+    Both timeouts are a multiple of the rolling p99 latency, clamped to a
+    floor and a ceiling. Until ``min_samples`` latencies have been observed
+    (e.g. a Heroku dyno that is still spinning up) the ceilings are used.
+    Every timeout that fires doubles the derived values until the next
+    success, so a dyno that falls asleep mid-session is not cut off forever.
+    """
+
+    def __init__(
+        self,
+        latency: LatencyTracker,
+        percentile: float = 99.0,
+        connect_multiplier: float = 3.0,
+        read_multiplier: float = 4.0,
+        connect_floor: float = CONNECT_TIMEOUT_FLOOR,
+        connect_ceiling: float = CONNECT_TIMEOUT_CEILING,
+        read_floor: float = READ_TIMEOUT_FLOOR,
+        read_ceiling: float = READ_TIMEOUT_CEILING,
+        min_samples: int = 10,
+    ):
+        self.latency = latency
+        self.percentile = percentile
+        self.connect_multiplier = connect_multiplier
+        self.read_multiplier = read_multiplier
+        self.connect_floor = connect_floor
+        self.connect_ceiling = connect_ceiling
+        self.read_floor = read_floor
+        self.read_ceiling = read_ceiling
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._backoff = 1.0
+        self._last: tuple = (connect_ceiling, read_ceiling)
+        self._source = "cold"
+        self.decisions = 0
+        self.connect_timeouts = 0
+        self.read_timeouts = 0
+
+    def current(self) -> tuple:
+        """Return ``(connect, read)`` timeouts for the next request."""
+        observed = self.latency.percentile(self.percentile) if len(self.latency) >= self.min_samples else None
+        with self._lock:
+            if observed is None:
+                connect, read, source = self.connect_ceiling, self.read_ceiling, "cold"
+            else:
+                connect = observed * self.connect_multiplier * self._backoff
+                read = observed * self.read_multiplier * self._backoff
+                connect = min(self.connect_ceiling, max(self.connect_floor, connect))
+                read = min(self.read_ceiling, max(self.read_floor, read))
+                source = "adaptive" if self._backoff == 1.0 else "backoff"
+            self._last = (connect, read)
+            self._source = source
+            self.decisions += 1
+            return connect, read
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._backoff = 1.0
+
+    def record_timeout(self, phase: str) -> None:
+        """Count a ``connect`` or ``read`` timeout and widen the next timeouts."""
+        with self._lock:
+            if phase == "connect":
+                self.connect_timeouts += 1
+            else:
+                self.read_timeouts += 1
+            self._backoff = min(self._backoff * 2, 64.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "connect": self._last[0],
+                "read": self._last[1],
+                "source": self._source,
+                "backoff": self._backoff,
+                "decisions": self.decisions,
+                "connect_timeouts": self.connect_timeouts,
+                "read_timeouts": self.read_timeouts,
+            }
+
+
+class RetryBudget:
+    """Global cap on retries as a fraction of requests.
+
+    Each request deposits ``ratio`` tokens and each retry spends one, so
+    retries add at most ``ratio`` extra load in steady state. ``min_tokens``
+    lets a quiet client still retry occasionally; the balance is capped at
+    ``max_tokens`` so a long healthy period cannot bank a retry storm.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_tokens: float = 2.0, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                self.exhausted += 1
+                return False
+            self._tokens -= 1.0
+            self.retries += 1
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tokens": self._tokens, "retries": self.retries, "exhausted": self.exhausted}
+
+
+class RetryPolicy:
+    """Retry idempotent GETs with full-jitter exponential backoff.
+
+    A retry happens only if the error is transient, attempts remain, the
+    shared ``RetryBudget`` has a token, and the backoff sleep still ends
+    before the caller's deadline.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        retry_statuses: frozenset = RETRY_STATUSES,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.budget = budget if budget is not None else RetryBudget()
+
+    def next_delay(self, attempt: int, deadline: Optional[float] = None) -> Optional[float]:
+        """Backoff before retry number ``attempt`` (1-based), or None to give up."""
+        if attempt >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        if not self.budget.try_spend():
+            return None
+        return delay
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second, holding at most ``burst``.
+
+    Tokens are handed out in arrival order: a caller that finds the bucket
+    empty takes its token anyway and is told how long to wait, so later
+    callers queue behind it.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Any = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """Take a token and return the seconds to wait before using it.
+
+        Returns None, without taking a token, if the wait would exceed ``max_wait``.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class RateLimiter:
+    """Client-side pacing of Wizard API calls, with one token bucket per endpoint.
+
+    The endpoint is the first path segment (``/wizards``, ``/elixirs``). A
+    single limiter is shared by the sync and async clients, hydration,
+    prewarming and snapshot downloads, so bursts from any of them are paced
+    together instead of being throttled upstream.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE_LIMIT_PER_SECOND,
+        burst: int = RATE_LIMIT_BURST,
+        clock: Any = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: dict = {}
+        self._stats: dict = {}
+
+    @staticmethod
+    def endpoint(path: str) -> str:
+        """Return the bucket name for a request path, e.g. ``/elixirs`` for ``/elixirs/{id}``."""
+        return "/" + path.lstrip("/").split("?", 1)[0].split("/", 1)[0]
+
+    def reserve(self, path: str, deadline: Optional[float] = None) -> float:
+        """Take a token for ``path`` and return the seconds to wait before sending.
+
+        Raises ``DeadlineExceededError`` if the wait would pass ``deadline``.
+        """
+        endpoint = self.endpoint(path)
+        with self._lock:
+            bucket = self._buckets.get(endpoint)
+            if bucket is None:
+                bucket = self._buckets[endpoint] = TokenBucket(self.rate, self.burst, self._clock)
+                self._stats[endpoint] = {"requests": 0, "delayed": 0, "wait_total": 0.0, "wait_max": 0.0}
+        wait = bucket.reserve(None if deadline is None else deadline - time.monotonic())
+        if wait is None:
+            raise DeadlineExceededError(f"rate limit wait for {endpoint} would exceed the lookup deadline")
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats["requests"] += 1
+            if wait > 0:
+                stats["delayed"] += 1
+                stats["wait_total"] += wait
+                stats["wait_max"] = max(stats["wait_max"], wait)
+        return wait
+
+    def acquire(self, path: str, deadline: Optional[float] = None) -> None:
+        """Block until a request to ``path`` may be sent."""
+        wait = self.reserve(path, deadline)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, path: str, deadline: Optional[float] = None) -> None:
+        """Async variant of ``acquire``."""
+        wait = self.reserve(path, deadline)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        """Return per-endpoint request counts and wait times in seconds."""
+        with self._lock:
+            return {
+                endpoint: {**stats, "wait_total": round(stats["wait_total"], 3), "wait_max": round(stats["wait_max"], 3)}
+                for endpoint, stats in self._stats.items()
+            }
+
+
+class JSONArrayStream:
+    """Incremental parser for the elements of a top-level JSON array.
+
+    Text is pushed in with ``feed``, which returns every element completed so
+    far, so a caller can stop reading the body as soon as it has enough.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._started = False
+        self.done = False
+
+    def feed(self, text: str) -> list:
+        """Consume ``text`` and return the array elements it completed."""
+        self._buffer += text
+        items = []
+        pos = 0
+        buffer = self._buffer
+        while not self.done:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not self._started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                self._started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                self.done = True
+                pos += 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # element not complete yet
+            if end == len(buffer) and not isinstance(item, (dict, list, str)):
+                break  # a trailing number or literal may continue in the next chunk
+            items.append(item)
+            pos = end
+        self._buffer = buffer[pos:]
+        return items
+
+    def close(self) -> list:
+        """Finish the stream, returning any last element; raise if it was cut short."""
+        items = self.feed(" ")
+        if not self.done:
+            raise ValueError("Truncated JSON array")
+        return items
+
+
+def _clamp_timeouts(timeouts: tuple, deadline: Optional[float]) -> tuple:
+    """Shrink ``(connect, read)`` timeouts to the time left before ``deadline``."""
+    if deadline is None:
+        return timeouts
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededError("lookup deadline exceeded")
+    return tuple(min(value, remaining) for value in timeouts)
+
+
+class HedgePolicy:
+    """Decide when to send a backup request for a slow one.
+
+    A hedge is sent once the first attempt has been outstanding longer than
+    the ``percentile`` of observed latency. Hedges are capped at
+    ``max_ratio`` of all requests and ``max_in_flight`` concurrent hedges, so
+    a slow API cannot be amplified into a load spike.
+    """
+
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        max_ratio: float = HEDGE_MAX_RATIO,
+        max_in_flight: int = 2,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+    ):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.max_in_flight = max_in_flight
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self, latency: LatencyTracker) -> Optional[float]:
+        """Seconds to wait before hedging, or None when there is too little data."""
+        with self._lock:
+            self.requests += 1
+        if len(latency) < self.min_samples:
+            return None
+        return latency.percentile(self.percentile)
+
+    def try_acquire(self) -> bool:
+        """Reserve budget for one hedge."""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return False
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            self._in_flight += 1
+            return True
+
+    def release(self, won: bool) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            if won:
+                self.hedge_wins += 1
+
+    def release_when_done(self, futures: list, won: bool) -> None:
+        """``release`` once every future or task in ``futures`` has finished.
+
+        A discarded attempt still occupies a connection until it completes,
+        so its hedge slot is only returned then.
+        """
+        remaining = len(futures)
+        if not remaining:
+            self.release(won)
+            return
+        lock = threading.Lock()
+
+        def finished(_future: Any) -> None:
+            nonlocal remaining
+            with lock:
+                remaining -= 1
+                last = remaining == 0
+            if last:
+                self.release(won)
+
+        for future in futures:
+            future.add_done_callback(finished)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "in_flight": self._in_flight,
+            }
+
+
+def _record_status(breaker: CircuitBreaker, status_code: int) -> None:
+    """Count 5xx responses as failures; anything else means the API is up."""
+    if status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        """Block until the leader finishes, then return its result or raise its error."""
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight block and receive the same result (or exception). Keys are
+    ``(kind, value)`` tuples such as ``("wizards", query)``, so a query can
+    never join a flight of another kind.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: tuple, fn: Any) -> Any:
+        """Run ``fn()`` unless a call for ``key`` is already in flight."""
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self.finish(key, flight)
+
+    def join(self, key: tuple) -> tuple:
+        """Return ``(flight, leader)`` for ``key``.
+
+        For callers that cannot wrap their work in one function (e.g. a
+        generator). The leader sets ``flight.result`` or ``flight.error`` and
+        must call ``finish``; followers call ``flight.wait()``.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executed += 1
+            else:
+                self.shared += 1
+        return flight, leader
+
+    def finish(self, key: tuple, flight: _Flight) -> None:
+        """Release the followers of a flight started with ``join``."""
+        with self._lock:
+            del self._flights[key]
+        flight.done.set()
+
+    def stats(self) -> dict:
+        """Return how many calls ran upstream and how many shared a result."""
+        return {"executed": self.executed, "shared": self.shared}
+
+
+class AsyncSingleFlight:
+    """Asyncio counterpart of ``SingleFlight`` for coroutines on one event loop."""
+
+    def __init__(self):
+        self._tasks: dict = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: tuple, coro_fn: Any) -> Any:
+        """Await ``coro_fn()`` unless a call for ``key`` is already in flight."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _task: self._tasks.pop(key, None))
+            self.executed += 1
+        else:
+            self.shared += 1
+        # Shield so one cancelled waiter does not cancel the shared request
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """Return how many calls ran upstream and how many shared a result."""
+        return {"executed": self.executed, "shared": self.shared}
+
+
+def _fuzzy_result(query: str, wizards: list, elixir_details: Optional[dict]) -> LookupResult:
+    potions_list = _build_potions_list(wizards, elixir_details)
+    if not potions_list:
+        return LookupResult(query)
+    matched = [_extract_wizard_info(wizard)["name"] for wizard in wizards]
+    return LookupResult(query, potions_list, fuzzy=True, matched=matched)
+
+
+class WizardClient:
+    """Wizard World API client sharing one keep-alive connection pool.
+
+    Every thread gets its own ``requests.Session`` (sessions are not
+    thread-safe), but all of them are mounted on the same ``HTTPAdapter`` so
+    TCP/TLS connections are pooled and reused across REPL and batch calls.
+    Records come from ``source``, which defaults to the HTTP API itself;
+    ``snapshot`` is shorthand for a ``SnapshotWizardSource`` plus a fuzzy
+    index over its wizards.
+    """
+
+    def __init__(
+        self,
+        base_url: str = WIZARD_API_BASE,
+        timeout: Optional[float] = None,
+        pool_size: int = WIZARD_POOL_SIZE,
+        keep_alive: bool = True,
+        cache: Optional[LookupCache] = None,
+        disk_cache: Optional[DiskLookupCache] = None,
+        snapshot: Optional[WizardSnapshot] = None,
+        fuzzy_index: Optional[FuzzyNameIndex] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: Optional[HedgePolicy] = None,
+        timeouts: Optional[AdaptiveTimeout] = None,
+        retry: Optional[RetryPolicy] = None,
+        hydrate: bool = False,
+        elixir_cache: Optional[LookupCache] = None,
+        negative_cache: Optional[LookupCache] = None,
+        prefilter: Optional[NameBloomFilter] = None,
+        stale_while_revalidate: float = STALE_WHILE_REVALIDATE,
+        stale_if_error: float = STALE_IF_ERROR,
+        rate_limiter: Optional[RateLimiter] = None,
+        source: Optional[WizardSource] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.cache = cache
+        self.disk_cache = disk_cache
+        if snapshot is not None:
+            if source is None:
+                source = SnapshotWizardSource(snapshot)
+            if fuzzy_index is None:
+                fuzzy_index = FuzzyNameIndex(snapshot.wizards)
+        self.fuzzy_index = fuzzy_index
+        self.inflight = SingleFlight()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.hedge = hedge
+        self.latency = LatencyTracker()
+        self.timeouts = timeouts if timeouts is not None else AdaptiveTimeout(self.latency)
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.hydrate = hydrate
+        self.negative_cache = negative_cache
+        self.prefilter = prefilter
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.rate_limiter = rate_limiter
+        self.source = source if source is not None else HTTPWizardSource(self)
+        self._refreshing: set = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor: Optional[ThreadPoolExecutor] = None
+        self.elixir_cache = elixir_cache if elixir_cache is not None else LookupCache(
+            max_entries=ELIXIR_CACHE_MAX_ENTRIES, ttl=ELIXIR_CACHE_TTL
+        )
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._local = threading.local()
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._hydrate_executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """Return the calling thread's session, creating it on first use."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            if not self.keep_alive:
+                session.headers["Connection"] = "close"
+            self._local.session = session
+        return session
+
+    def _executor(self, attr: str, max_workers: int, thread_name_prefix: str) -> ThreadPoolExecutor:
+        """Return the executor stored in ``attr``, creating it exactly once."""
+        executor = getattr(self, attr)
+        if executor is None:
+            with self._executor_lock:
+                executor = getattr(self, attr)
+                if executor is None:
+                    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+                    setattr(self, attr, executor)
+        return executor
+
+    def request_timeouts(self, deadline: Optional[float] = None) -> tuple:
+        """Return ``(connect, read)`` timeouts: fixed if ``timeout`` was given, else adaptive.
+
+        Both are clamped to the time left before ``deadline``.
+        """
+        if self.timeout is not None:
+            timeouts = (self.timeout, self.timeout)
+        else:
+            timeouts = self.timeouts.current()
+        return _clamp_timeouts(timeouts, deadline)
+
+    def get_json(
+        self,
+        path: str,
+        params: Optional[dict] = None,
+        deadline: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        """GET ``path`` relative to the API base and return the decoded JSON.
+
+        Transient failures are retried per ``self.retry``; ``deadline`` is an
+        absolute ``time.monotonic()`` value no attempt or backoff may pass.
+        With ``limit`` the response must be a JSON array; it is parsed as it
+        streams in and only the first ``limit`` elements are read.
+        """
+        url = self._url(path, params)
+        if self.hedge is None:
+            return self._with_retries(lambda: self._get_once(url, deadline, limit), deadline)
+        return self._with_retries(lambda: self._hedged_get(url, deadline, limit), deadline)
+
+    def iter_json_array(
+        self,
+        path: str,
+        params: Optional[dict] = None,
+        deadline: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator:
+        """Yield the elements of a JSON array response as they are parsed.
+
+        Like ``get_json`` with a ``limit``, but elements are handed over while
+        the body is still arriving. Failures before the body starts are
+        retried; requests are not hedged. No latency sample is recorded, as
+        the read is paced by the caller.
+        """
+        url = self._url(path, params)
+        response, _started = self._with_retries(lambda: self._open(url, deadline, stream=True), deadline)
+        yield from self._iter_array(response, limit)
+        self.timeouts.record_success()
+
+    def _url(self, path: str, params: Optional[dict]) -> str:
+        url = f"{self.base_url}{path}"
+        return f"{url}?{urlencode(params)}" if params else url
+
+    def _with_retries(self, call: Any, deadline: Optional[float]) -> Any:
+        """Run ``call``, retrying transient request failures per ``self.retry``."""
+        self.retry.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                return call()
+            except requests.RequestException as e:
+                delay = self.retry.next_delay(attempt, deadline) if self._is_retryable(e) else None
+                if delay is None:
+                    raise
+                logger.info(f"Retrying wizard API request in {delay:.2f}s after: {e}")
+                time.sleep(delay)
+                attempt += 1
+
+    def _is_retryable(self, error: requests.RequestException) -> bool:
+        if isinstance(error, requests.HTTPError):
+            status = error.response.status_code if error.response is not None else None
+            return status in self.retry.retry_statuses
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def _get_once(self, url: str, deadline: Optional[float] = None, limit: Optional[int] = None) -> Any:
+        """Send a single GET through the rate limiter and circuit breaker and record its latency."""
+        response, started = self._open(url, deadline, stream=limit is not None)
+        data = _json_loads(response.content) if limit is None else self._read_array_prefix(response, limit)
+        self.latency.record(time.monotonic() - started)
+        self.timeouts.record_success()
+        return data
+
+    def _open(self, url: str, deadline: Optional[float], stream: bool) -> tuple:
+        """Send a GET through the rate limiter and circuit breaker and check its status.
+
+        Returns ``(response, started)``, where ``started`` is when the request
+        was actually sent, after any rate limiter wait.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(url[len(self.base_url):], deadline)
+        timeout = self.request_timeouts(deadline)
+        self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, timeout=timeout, stream=stream)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            if isinstance(e, requests.ConnectTimeout):
+                self.timeouts.record_timeout("connect")
+            elif isinstance(e, requests.Timeout):
+                self.timeouts.record_timeout("read")
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        _record_status(self.breaker, response.status_code)
+        if response.status_code >= 400:
+            # A streamed response keeps its connection until the body is read;
+            # drain the (small) error body so it goes back to the pool
+            try:
+                response.content
+            except requests.RequestException:
+                pass
+            response.close()
+            response.raise_for_status()
+        return response, started
+
+    @classmethod
+    def _read_array_prefix(cls, response: requests.Response, limit: int) -> list:
+        """Parse the first ``limit`` elements of a streamed JSON array body."""
+        return list(cls._iter_array(response, limit))
+
+    @staticmethod
+    def _iter_array(response: requests.Response, limit: Optional[int] = None) -> Iterator:
+        """Yield up to ``limit`` elements of a streamed JSON array body as they are parsed.
+
+        A body that is read to the end returns its connection to the pool.
+        Stopping early drops that connection instead, which for broad queries
+        is cheaper than downloading the rest.
+        """
+        stream = JSONArrayStream()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        remaining = math.inf if limit is None else limit
+        try:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                for item in stream.feed(decoder.decode(chunk)):
+                    if remaining > 0:
+                        yield item
+                        remaining -= 1
+                if remaining <= 0 and not stream.done:
+                    return
+            for item in stream.feed(decoder.decode(b"", final=True)) + stream.close():
+                if remaining <= 0:
+                    return
+                yield item
+                remaining -= 1
+        finally:
+            response.close()
+
+    def _hedged_get(self, url: str, deadline: Optional[float] = None, limit: Optional[int] = None) -> Any:
+        """GET ``url``, sending one backup request if the first is unusually slow.
+
+        ``requests`` cannot abort a transfer from another thread, so the losing
+        attempt is cancelled if it has not started and otherwise discarded.
+        """
+        executor = self._executor("_hedge_executor", self.pool_size, "wizard-hedge")
+        delay = self.hedge.delay(self.latency)
+        primary = executor.submit(self._get_once, url, deadline, limit)
+        if delay is None or wait([primary], timeout=delay).done or not self.hedge.try_acquire():
+            return primary.result()
+
+        secondary = executor.submit(self._get_once, url, deadline, limit)
+        pending = {primary, secondary}
+        error: Optional[BaseException] = None
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        winner = future
+                        break
+                    error = future.exception()
+        finally:
+            running = [future for future in pending if not future.cancel()]
+            self.hedge.release_when_done(running, won=winner is secondary)
+        if winner is None:
+            raise error
+        return winner.result()
+
+    def lookup(self, query: str, deadline: Optional[float] = None, grouped: bool = False) -> str:
+        """Search wizards by name and return the lookup JSON payload (see ``LookupResult.to_dict``)."""
+        return self.lookup_result(query, deadline).to_json(grouped)
+
+    def lookup_result(self, query: str, deadline: Optional[float] = None) -> LookupResult:
+        """Search wizards by name.
+
+        ``deadline`` is an optional absolute ``time.monotonic()`` limit for
+        the upstream request including retries.
+        """
+        query = query.strip()
+        if not query:
+            return _empty_query_result()
+
+        entry = self._cache_lookup(query)
+        if entry is not None:
+            potions_list, stale_for = entry
+            if stale_for < 0:
+                return LookupResult(query, potions_list)
+            if stale_for < self.stale_while_revalidate:
+                self._schedule_refresh(query)
+                return LookupResult(query, potions_list, stale=True)
+        if self._known_miss(query):
+            return self._fuzzy_lookup(query)
+
+        try:
+            wizards = self._fetch_wizards(query, deadline) or []
+            potions_list = _build_potions_list(wizards, self._hydrate(wizards, deadline))
+
+        except WizardLookupError as e:
+            logger.info(f"Skipping wizard API call: {e}")
+            return self._stale_or_error(query, entry, f"API unavailable: {e}")
+        except requests.RequestException as e:
+            logger.warning(f"Failed to query wizard API: {e}")
+            return self._stale_or_error(query, entry, f"API request failed: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error in wizard lookup: {e}")
+            return self._stale_or_error(query, entry, f"Unexpected error: {e}")
+
+        if not potions_list:
+            self._negative_put(query)
+            self._cache_delete(query)
+            return self._fuzzy_lookup(query)
+        self._cache_put(query, potions_list)
+        return LookupResult(query, potions_list)
+
+    def iter_potions(self, query: str, deadline: Optional[float] = None) -> Iterator[PotionEntry]:
+        """Yield the potion rows for ``query`` as the wizards are parsed from the source.
+
+        Cache, prefilter and fuzzy handling match ``lookup_result``.
+        On a cache miss each wizard's rows are yielded as soon as that wizard
+        is parsed (and hydrated, if enabled), and the complete result is
+        cached once the stream ends. Concurrent streams for the same
+        normalized query share one upstream read: followers wait for the
+        leader's complete list. Source errors are raised, unless nothing
+        was yielded yet and a stale cache entry can be served instead.
+        """
+        query = query.strip()
+        if not query:
+            return
+        if self._known_miss(query):
+            yield from self.lookup_result(query, deadline).potions
+            return
+
+        entry = self._cache_lookup(query)
+        if entry is not None and entry[1] < self.stale_while_revalidate:
+            if entry[1] >= 0:
+                self._schedule_refresh(query)
+            yield from entry[0]
+            return
+
+        key = ("stream", _normalize_query(query))
+        flight, leader = self.inflight.join(key)
+        if not leader:
+            potions_list = flight.wait()
+            if potions_list is None:
+                # The leader's consumer stopped early; look the query up ourselves.
+                potions_list = self.lookup_result(query, deadline).potions
+            yield from potions_list
+            return
+
+        streamed: list = []
+        try:
+            for potion in self._stream_potions(query, deadline, entry):
+                streamed.append(potion)
+                yield potion
+            flight.result = streamed
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self.inflight.finish(key, flight)
+
+    def _stream_potions(
+        self, query: str, deadline: Optional[float], entry: Optional[tuple]
+    ) -> Iterator[PotionEntry]:
+        """Stream a cache miss from the source; the leader half of ``iter_potions``."""
+        potions_list: list = []
+        try:
+            for wizard in self.source.iter_wizards(query, deadline):
+                rows = _build_potions_list([wizard], self._hydrate([wizard], deadline))
+                potions_list.extend(rows)
+                yield from rows
+        except Exception as e:
+            if potions_list or entry is None or entry[1] >= self.stale_if_error:
+                raise
+            logger.info(f"Serving stale result for {query!r} after: {e}")
+            yield from entry[0]
+            return
+
+        if potions_list:
+            self._cache_put(query, potions_list)
+            return
+        self._negative_put(query)
+        self._cache_delete(query)
+        yield from self._fuzzy_lookup(query).potions
+
+    def _stale_or_error(self, query: str, entry: Optional[tuple], error: str) -> LookupResult:
+        """Serve an expired cache entry if the upstream failed, else the error result."""
+        if entry is not None and entry[1] < self.stale_if_error:
+            logger.info(f"Serving stale result for {query!r} after: {error}")
+            return LookupResult(query, entry[0], stale=True)
+        return LookupResult(query, error=error)
+
+    def _schedule_refresh(self, query: str) -> None:
+        """Refresh an expired entry in the background, once per key at a time."""
+        key = self._cache_key(query)
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor("_refresh_executor", 2, "wizard-refresh").submit(self._refresh, query, key)
+
+    def _refresh(self, query: str, key: str) -> None:
+        try:
+            wizards = self._fetch_wizards(query) or []
+            potions_list = _build_potions_list(wizards, self._hydrate(wizards))
+            if potions_list:
+                self._cache_put(query, potions_list)
+            else:
+                self._negative_put(query)
+                self._cache_delete(query)
+        except Exception as e:
+            logger.warning(f"Background refresh of {query!r} failed: {e}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+
+    def lookup_many(self, queries: list, max_concurrency: int = LOOKUP_MANY_CONCURRENCY) -> list:
+        """Look up many queries concurrently.
+
+        Queries are deduplicated by normalized form and at most
+        ``max_concurrency`` run at once. Results are returned in input order as
+        ``{"query", "potions"}`` dicts; a failing item carries an ``error`` key
+        instead of failing the batch.
+        """
+        unique = {}
+        for query in queries:
+            unique.setdefault(_normalize_query(query), query)
+
+        def run_one(query: str) -> dict:
+            try:
+                return self.lookup_result(query).to_dict()
+            except Exception as e:
+                logger.error(f"Unexpected error in batch wizard lookup: {e}")
+                return {"query": query.strip(), "potions": [], "error": f"Unexpected error: {e}"}
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            results = dict(zip(unique, executor.map(run_one, unique.values())))
+
+        return [
+            {**results[_normalize_query(query)], "query": query.strip()} for query in queries
+        ]
+
+    def prewarm(self, queries: list = (), connections: int = WARMUP_CONNECTIONS) -> threading.Thread:
+        """Warm the connection pool and lookup cache in a background thread.
+
+        Opens up to ``connections`` pooled connections to the API, which also
+        wakes an idle server, then looks up ``queries`` so the first prompts
+        are answered from cache. Failures are logged and otherwise ignored.
+        """
+        thread = threading.Thread(
+            target=self._prewarm, args=(list(queries), connections), name="wizard-prewarm", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _prewarm(self, queries: list, connections: int) -> None:
+        started = time.monotonic()
+        connections = min(connections, self.pool_size)
+        if self.source.remote and connections > 0:
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                list(executor.map(lambda _: self._warm_connection(), range(connections)))
+        if queries:
+            self.lookup_many(queries)
+        logger.info(f"Prewarmed {len(queries)} queries in {time.monotonic() - started:.2f}s")
+
+    def _warm_connection(self) -> None:
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire("/")
+            self.session.head(self.base_url, timeout=self.request_timeouts()).close()
+        except requests.RequestException as e:
+            logger.info(f"Connection warmup failed: {e}")
+
+    def _fetch_wizards(self, query: str, deadline: Optional[float] = None) -> list:
+        """Fetch matching wizards, sharing one upstream request per normalized query."""
+        return self.inflight.do(
+            ("wizards", _normalize_query(query)), lambda: self.source.search_wizards(query, deadline)
+        )
+
+    def _hydrate(self, wizards: list, deadline: Optional[float] = None) -> Optional[dict]:
+        """Fetch elixir details for ``wizards`` when hydration is enabled.
+
+        Local sources are read directly. For remote ones each elixir id is
+        served from ``elixir_cache`` when possible; the rest are fetched
+        concurrently, with one request per id even across concurrent lookups.
+        Failed fetches are skipped.
+        """
+        if not self.hydrate:
+            return None
+        ids = _elixir_ids(wizards)
+        if not self.source.remote:
+            return self._read_local_elixirs(ids)
+
+        details = {}
+        missing = []
+        for elixir_id in ids:
+            cached = self.elixir_cache.get(elixir_id)
+            if cached is None:
+                missing.append(elixir_id)
+            elif cached:  # False marks an id the source does not know
+                details[elixir_id] = cached
+        if missing:
+            executor = self._executor("_hydrate_executor", HYDRATE_CONCURRENCY, "wizard-hydrate")
+            fetched = executor.map(lambda i: self._fetch_elixir(i, deadline), missing)
+            for elixir_id, detail in zip(missing, fetched):
+                if detail is not None:
+                    details[elixir_id] = detail
+        return details
+
+    def _fetch_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        """Fetch one elixir's details through the shared id-keyed cache."""
+
+        def fetch() -> Optional[dict]:
+            cached = self.elixir_cache.get(elixir_id)
+            if cached is not None:
+                return cached or None
+            detail = self.source.get_elixir(elixir_id, deadline)
+            self._elixir_cache_put(elixir_id, detail)
+            return detail
+
+        try:
+            return self.inflight.do(("elixir", elixir_id), fetch)
+        except (requests.RequestException, WizardLookupError) as e:
+            logger.warning(f"Failed to fetch elixir {elixir_id}: {e}")
+            return None
+
+    def _elixir_cache_put(self, elixir_id: str, detail: Optional[dict]) -> None:
+        """Cache an elixir, or for ``ELIXIR_MISS_TTL`` the fact that the source has none."""
+        if detail is None:
+            self.elixir_cache.set(elixir_id, False, ttl=ELIXIR_MISS_TTL)
+        else:
+            self.elixir_cache.set(elixir_id, detail)
+
+    def _read_local_elixirs(self, ids: list) -> dict:
+        """Read elixir details straight from a local source, skipping unreadable ids."""
+        details = {}
+        for elixir_id in ids:
+            try:
+                detail = self.source.get_elixir(elixir_id)
+            except WizardLookupError as e:
+                logger.warning(f"Failed to read elixir {elixir_id}: {e}")
+                continue
+            if detail is not None:
+                details[elixir_id] = detail
+        return details
+
+    def _fuzzy_wizards(self, query: str) -> list:
+        if self.fuzzy_index is None:
+            return []
+        return [wizard for _score, wizard in self.fuzzy_index.search(query)]
+
+    def _fuzzy_lookup(self, query: str) -> LookupResult:
+        """Resolve a query with no exact match against the local fuzzy index."""
+        wizards = self._fuzzy_wizards(query)
+        return _fuzzy_result(query, wizards, self._hydrate(wizards) if wizards else None)
+
+    def _known_miss(self, query: str) -> bool:
+        """True if ``query`` is known to match nothing, so the API call can be skipped."""
+        if self.prefilter is not None and not self.prefilter.might_match(query):
+            return True
+        return self.negative_cache is not None and self.negative_cache.get(_normalize_query(query)) is not None
+
+    def _negative_put(self, query: str) -> None:
+        if self.negative_cache is not None:
+            self.negative_cache.set(_normalize_query(query), True)
+
+    def _cache_key(self, query: str) -> str:
+        # Results from different APIs or catalogs, and hydrated and plain
+        # results, differ, so they must not share (disk) cache entries
+        key = f"{self.source.scope}\x00{_normalize_query(query)}"
+        return f"{key}\x00hydrated" if self.hydrate else key
+
+    def _cache_lookup(self, query: str) -> Optional[tuple]:
+        """Return ``(potions_list, stale_for)`` from the memory or disk cache, or None."""
+        key = self._cache_key(query)
+        if self.cache is not None:
+            entry = self.cache.get_stale(key)
+            if entry is not None:
+                return entry
+        if self.disk_cache is not None:
+            try:
+                entry = self.disk_cache.get_stale(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache read failed: {e}")
+                return None
+            if entry is None:
+                return None
+            entry = ([PotionEntry.from_dict(potion) for potion in entry[0]], entry[1])
+            if entry[1] < 0 and self.cache is not None:
+                self.cache.set(key, entry[0], ttl=-entry[1])
+            return entry
+        return None
+
+    def _cache_delete(self, query: str) -> None:
+        key = self._cache_key(query)
+        if self.cache is not None:
+            self.cache.delete(key)
+        if self.disk_cache is not None:
+            try:
+                self.disk_cache.delete(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache write failed: {e}")
+
+    def _cache_put(self, query: str, potions_list: list) -> None:
+        # Empty results are not cached: they are cheap to confirm and may be transient
+        if not potions_list:
+            return
+        key = self._cache_key(query)
+        if self.cache is not None:
+            self.cache.set(key, potions_list)
+        if self.disk_cache is not None:
+            try:
+                self.disk_cache.set(key, [potion.to_dict(with_id=True) for potion in potions_list])
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache write failed: {e}")
+
+    def metrics(self) -> dict:
+        """Return cache, coalescing, circuit breaker, timeout, retry, rate limit and latency metrics."""
+        return {
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "elixir_cache": self.elixir_cache.stats(),
+            "negative_cache": self.negative_cache.stats() if self.negative_cache is not None else None,
+            "prefilter_rejected": self.prefilter.rejected if self.prefilter is not None else None,
+            "disk_cache": self.disk_cache.stats() if self.disk_cache is not None else None,
+            "inflight": self.inflight.stats(),
+            "circuit": self.breaker.stats(),
+            "hedge": self.hedge.stats() if self.hedge is not None else None,
+            "timeouts": self.timeouts.stats() if self.timeout is None else {"fixed": self.timeout},
+            "retry_budget": self.retry.budget.stats(),
+            "rate_limit": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+            "latency_p50": self.latency.percentile(50),
+            "latency_p99": self.latency.percentile(99),
+        }
+
+    def close(self) -> None:
+        """Close pooled connections, the source and the disk cache."""
+        for executor in (self._hedge_executor, self._hydrate_executor, self._refresh_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._adapter.close()
+        self.source.close()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+
+    def __enter__(self) -> "WizardClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class AsyncWizardClient:
+    """Asyncio Wizard World API client built on ``httpx.AsyncClient``.
+
+    Takes its base URL, timeouts and pool size from a ``WizardClient`` so both
+    transports are configured in one place. The underlying httpx client is
+    bound to the event loop that first used it and is recreated for a new loop;
+    it is closed by ``aclose`` or, failing that, when its loop shuts down its
+    async generators (as ``asyncio.run`` does).
+    """
+
+    def __init__(self, client: Optional[WizardClient] = None, transport: Any = None):
+        try:
+            import httpx
+        except ImportError as e:
+            raise RuntimeError(
+                "httpx is required for async wizard lookups. Install it with: pip install httpx"
+            ) from e
+
+        self._httpx = httpx
+        self.client = client if client is not None else get_wizard_client()
+        self._transport = transport
+        self._http: Any = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closer: Any = None
+        self.inflight = AsyncSingleFlight()
+        # Native httpx calls replace the sync HTTP source; other sources are shared as-is
+        self.source = (
+            AsyncHTTPWizardSource(self) if isinstance(self.client.source, HTTPWizardSource) else self.client.source
+        )
+
+    async def _get_http(self) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._loop is not loop:
+            if self._closer is not None and not self._loop.is_closed():
+                asyncio.run_coroutine_threadsafe(self._closer.aclose(), self._loop)
+            limits = self._httpx.Limits(
+                max_connections=self.client.pool_size,
+                max_keepalive_connections=self.client.pool_size if self.client.keep_alive else 0,
+            )
+            self._http = self._httpx.AsyncClient(
+                base_url=self.client.base_url,
+                limits=limits,
+                transport=self._transport,
+            )
+            self._loop = loop
+            # The loop finalizes this suspended generator before it closes,
+            # which closes the pool while its transports can still be closed
+            self._closer = _close_on_loop_shutdown(self._http)
+            await self._closer.__anext__()
+        return self._http
+
+    async def get_json(
+        self,
+        path: str,
+        params: Optional[dict] = None,
+        deadline: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        """GET ``path`` relative to the API base and return the decoded JSON.
+
+        Retries, deadline handling and ``limit`` follow ``WizardClient.get_json``.
+        """
+        retry = self.client.retry
+        retry.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                return await self._hedged_get(path, params, deadline, limit)
+            except self._httpx.HTTPError as e:
+                delay = retry.next_delay(attempt, deadline) if self._is_retryable(e) else None
+                if delay is None:
+                    raise
+                logger.info(f"Retrying wizard API request in {delay:.2f}s after: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, self._httpx.HTTPStatusError):
+            return error.response.status_code in self.client.retry.retry_statuses
+        return isinstance(error, self._httpx.TransportError)
+
+    async def _hedged_get(
+        self, path: str, params: Optional[dict], deadline: Optional[float], limit: Optional[int]
+    ) -> Any:
+        """GET with an optional hedge; the losing attempt is cancelled."""
+        hedge = self.client.hedge
+        if hedge is None:
+            return await self._get_once(path, params, deadline, limit)
+
+        delay = hedge.delay(self.client.latency)
+        primary = asyncio.ensure_future(self._get_once(path, params, deadline, limit))
+        tasks = [primary]
+        acquired = False
+        won = False
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and hedge.try_acquire():
+                    acquired = True
+                    tasks.append(asyncio.ensure_future(self._get_once(path, params, deadline, limit)))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        won = task is not primary
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            running = [task for task in tasks if not task.done()]
+            for task in running:
+                task.cancel()
+            if acquired:
+                hedge.release_when_done(running, won=won)
+
+    async def _get_once(
+        self,
+        path: str,
+        params: Optional[dict],
+        deadline: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> Any:
+        """Send a single GET through the rate limiter and circuit breaker and record its latency."""
+        if self.client.rate_limiter is not None:
+            await self.client.rate_limiter.acquire_async(path, deadline)
+        breaker = self.client.breaker
+        timeouts = self.client.timeouts
+        connect, read = self.client.request_timeouts(deadline)
+        timeout = self._httpx.Timeout(read, connect=connect)
+        http = await self._get_http()
+        breaker.before_call()
+        started = time.monotonic()
+        try:
+            async with http.stream("GET", path, params=params, timeout=timeout) as response:
+                _record_status(breaker, response.status_code)
+                response.raise_for_status()
+                if limit is None:
+                    data = _json_loads(await response.aread())
+                else:
+                    data = await self._read_array_prefix(response, limit)
+        except self._httpx.HTTPError as e:
+            if not isinstance(e, self._httpx.HTTPStatusError):
+                breaker.record_failure()
+            if isinstance(e, self._httpx.ConnectTimeout):
+                timeouts.record_timeout("connect")
+            elif isinstance(e, self._httpx.TimeoutException):
+                timeouts.record_timeout("read")
+            raise
+        except BaseException:
+            # e.g. a cancelled hedge: settle the probe slot; a no-op once a status was recorded
+            breaker.release()
+            raise
+        self.client.latency.record(time.monotonic() - started)
+        timeouts.record_success()
+        return data
+
+    @staticmethod
+    async def _read_array_prefix(response: Any, limit: int) -> list:
+        """Parse the first ``limit`` elements of a streamed JSON array body."""
+        stream = JSONArrayStream()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        items: list = []
+        async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+            items.extend(stream.feed(decoder.decode(chunk)))
+            if len(items) >= limit and not stream.done:
+                return items[:limit]
+        items.extend(stream.feed(decoder.decode(b"", final=True)))
+        items.extend(stream.close())
+        return items[:limit]
+
+    async def lookup(self, query: str, deadline: Optional[float] = None, grouped: bool = False) -> str:
+        """Search wizards by name and return the lookup JSON payload."""
+        return (await self.lookup_result(query, deadline)).to_json(grouped)
+
+    async def lookup_result(self, query: str, deadline: Optional[float] = None) -> LookupResult:
+        """Async variant of ``WizardClient.lookup_result``."""
+        query = query.strip()
+        if not query:
+            return _empty_query_result()
+
+        entry = await self._cache_lookup(query)
+        if entry is not None:
+            potions_list, stale_for = entry
+            if stale_for < 0:
+                return LookupResult(query, potions_list)
+            if stale_for < self.client.stale_while_revalidate:
+                self.client._schedule_refresh(query)
+                return LookupResult(query, potions_list, stale=True)
+        if self.client._known_miss(query):
+            wizards = self.client._fuzzy_wizards(query)
+            return _fuzzy_result(query, wizards, await self._hydrate(wizards) if wizards else None)
+
+        try:
+            wizards = await self.inflight.do(
+                ("wizards", _normalize_query(query)), lambda: self.source.asearch_wizards(query, deadline)
+            ) or []
+            potions_list = _build_potions_list(wizards, await self._hydrate(wizards, deadline))
+
+        except WizardLookupError as e:
+            logger.info(f"Skipping wizard API call: {e}")
+            return self.client._stale_or_error(query, entry, f"API unavailable: {e}")
+        except self._httpx.HTTPError as e:
+            logger.warning(f"Failed to query wizard API: {e}")
+            return self.client._stale_or_error(query, entry, f"API request failed: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error in wizard lookup: {e}")
+            return self.client._stale_or_error(query, entry, f"Unexpected error: {e}")
+
+        if not potions_list:
+            self.client._negative_put(query)
+            await self._disk_cache_call(self.client._cache_delete, query)
+            wizards = self.client._fuzzy_wizards(query)
+            return _fuzzy_result(query, wizards, await self._hydrate(wizards) if wizards else None)
+        await self._disk_cache_call(self.client._cache_put, query, potions_list)
+        return LookupResult(query, potions_list)
+
+    async def _cache_lookup(self, query: str) -> Optional[tuple]:
+        """``WizardClient._cache_lookup`` with memory hits served inline and disk reads off the loop."""
+        client = self.client
+        if client.cache is not None:
+            entry = client.cache.get_stale(client._cache_key(query))
+            if entry is not None:
+                return entry
+        if client.disk_cache is None:
+            return None
+        return await asyncio.to_thread(client._cache_lookup, query)
+
+    async def _disk_cache_call(self, fn: Any, *args: Any) -> Any:
+        """Call a client cache method, in a worker thread if it may block on the SQLite disk cache."""
+        if self.client.disk_cache is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def _hydrate(self, wizards: list, deadline: Optional[float] = None) -> Optional[dict]:
+        """Async variant of ``WizardClient._hydrate`` sharing its elixir cache."""
+        client = self.client
+        if not client.hydrate:
+            return None
+        if not self.source.remote:
+            return await asyncio.to_thread(client._hydrate, wizards, deadline)
+
+        details = {}
+        missing = []
+        for elixir_id in _elixir_ids(wizards):
+            cached = client.elixir_cache.get(elixir_id)
+            if cached is None:
+                missing.append(elixir_id)
+            elif cached:  # False marks an id the source does not know
+                details[elixir_id] = cached
+        semaphore = asyncio.Semaphore(HYDRATE_CONCURRENCY)
+
+        async def fetch(elixir_id: str) -> Optional[dict]:
+            async def fetch_once() -> Optional[dict]:
+                cached = client.elixir_cache.get(elixir_id)
+                if cached is not None:
+                    return cached or None
+                async with semaphore:
+                    detail = await self.source.aget_elixir(elixir_id, deadline)
+                client._elixir_cache_put(elixir_id, detail)
+                return detail
+
+            try:
+                return await self.inflight.do(("elixir", elixir_id), fetch_once)
+            except (self._httpx.HTTPError, WizardLookupError) as e:
+                logger.warning(f"Failed to fetch elixir {elixir_id}: {e}")
+                return None
+
+        for elixir_id, detail in zip(missing, await asyncio.gather(*(fetch(i) for i in missing))):
+            if detail is not None:
+                details[elixir_id] = detail
+        return details
+
+    async def lookup_many(self, queries: list, max_concurrency: int = LOOKUP_MANY_CONCURRENCY) -> list:
+        """Async variant of ``WizardClient.lookup_many`` bounded by a semaphore."""
+        unique = {}
+        for query in queries:
+            unique.setdefault(_normalize_query(query), query)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run_one(query: str) -> dict:
+            async with semaphore:
+                try:
+                    return (await self.lookup_result(query)).to_dict()
+                except Exception as e:
+                    logger.error(f"Unexpected error in batch wizard lookup: {e}")
+                    return {"query": query.strip(), "potions": [], "error": f"Unexpected error: {e}"}
+
+        outputs = await asyncio.gather(*(run_one(query) for query in unique.values()))
+        results = dict(zip(unique, outputs))
+        return [
+            {**results[_normalize_query(query)], "query": query.strip()} for query in queries
+        ]
+
+    async def aclose(self) -> None:
+        """Close pooled connections."""
+        if self._closer is not None:
+            await self._closer.aclose()
+            self._closer = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+async def _close_on_loop_shutdown(http: Any) -> Any:
+    """Async generator that closes ``http`` when it is finalized; see ``AsyncWizardClient._get_http``."""
+    try:
+        yield
+    finally:
+        await http.aclose()
+
+
+_default_client: Optional[WizardClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_wizard_client() -> WizardClient:
+    """Return the process-wide client, creating it on first use."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = WizardClient(
+                cache=LookupCache(stale_ttl=STALE_IF_ERROR),
+                negative_cache=LookupCache(max_entries=NEGATIVE_CACHE_MAX_ENTRIES, ttl=NEGATIVE_CACHE_TTL),
+                rate_limiter=RateLimiter(),
+            )
+        return _default_client
+
+
+def set_wizard_client(client: WizardClient) -> None:
+    """Replace the process-wide client used by ``_wizard_lookup``."""
+    global _default_client, _default_async_client
+    with _default_client_lock:
+        _default_client = client
+        _default_async_client = None
+
+
+_default_async_client: Optional[AsyncWizardClient] = None
+
+
+def get_async_wizard_client() -> AsyncWizardClient:
+    """Return the process-wide async client, wrapping the shared sync client."""
+    global _default_async_client
+    client = get_wizard_client()
+    with _default_client_lock:
+        if _default_async_client is None:
+            _default_async_client = AsyncWizardClient(client)
+        return _default_async_client
 
 
 def _wizard_lookup(query: str) -> str:
@@ -57,44 +2829,111 @@ def _wizard_lookup(query: str) -> str:
     Returns:
         JSON string with query and potions list
     """
-    query = query.strip()
-    if not query:
-        return json.dumps({"query": "", "potions": [], "error": "Please provide a search query"})
+    return get_wizard_client().lookup(query)
 
-    potions_list = []
 
-    try:
-        params = {"name": query}
-        url = f"{WIZARD_API_BASE}/wizards?{urlencode(params)}"
-        response = requests.get(url, timeout=WIZARD_API_TIMEOUT)
-        response.raise_for_status()
-
-        wizards = response.json()
-        if not wizards:
-            return json.dumps({"query": query, "potions": []})
-
-        for wizard in wizards[:MAX_WIZARD_RESULTS]:
-            wizard_info = _extract_wizard_info(wizard)
-            for potion in wizard_info["potions"]:
-                potion_data = _format_potion(potion)
-                potions_list.append({"wizard": wizard_info["name"], **potion_data})
-
-    except requests.RequestException as e:
-        logger.warning(f"Failed to query wizard API: {e}")
-        return json.dumps(
-            {"query": query, "potions": [], "error": f"API request failed: {e}"}
-        )
-    except Exception as e:
-        logger.error(f"Unexpected error in wizard lookup: {e}")
-        return json.dumps(
-            {"query": query, "potions": [], "error": f"Unexpected error: {e}"}
-        )
+class HTTPWizardSource(WizardSource):
+    """Source calling the Wizard World API through a ``WizardClient``'s pooled sessions."""
+
+    remote = True
+
+    def __init__(self, client: WizardClient):
+        self.client = client
+
+    @property
+    def scope(self) -> str:
+        return self.client.base_url
+
+    def search_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        return self.client.get_json("/wizards", {"name": name}, deadline, limit=MAX_WIZARD_RESULTS) or []
+
+    def iter_wizards(self, name: str, deadline: Optional[float] = None) -> Iterator[dict]:
+        return self.client.iter_json_array("/wizards", {"name": name}, deadline, limit=MAX_WIZARD_RESULTS)
+
+    def get_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        try:
+            return self.client.get_json(f"/elixirs/{quote(elixir_id)}", deadline=deadline)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
 
-    return json.dumps({"query": query, "potions": potions_list}, ensure_ascii=False)
 
+class AsyncHTTPWizardSource(WizardSource):
+    """Source calling the Wizard World API through an ``AsyncWizardClient``.
+
+    The synchronous methods go through the wrapped ``WizardClient``'s pooled
+    sessions instead, so they neither need nor block an event loop.
+    """
+
+    remote = True
+
+    def __init__(self, client: AsyncWizardClient):
+        self.client = client
+        self._sync = HTTPWizardSource(client.client)
+
+    @property
+    def scope(self) -> str:
+        return self._sync.scope
+
+    async def asearch_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        return await self.client.get_json("/wizards", {"name": name}, deadline, limit=MAX_WIZARD_RESULTS) or []
+
+    async def aget_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        try:
+            return await self.client.get_json(f"/elixirs/{quote(elixir_id)}", deadline=deadline)
+        except self.client._httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
 
-# LangChain tool wrapper
-wizard_lookup = tool(_wizard_lookup)
+    def search_wizards(self, name: str, deadline: Optional[float] = None) -> list:
+        return self._sync.search_wizards(name, deadline)
+
+    def iter_wizards(self, name: str, deadline: Optional[float] = None) -> Iterator[dict]:
+        return self._sync.iter_wizards(name, deadline)
+
+    def get_elixir(self, elixir_id: str, deadline: Optional[float] = None) -> Optional[dict]:
+        return self._sync.get_elixir(elixir_id, deadline)
+
+
+def refresh_snapshot(
+    path: str,
+    client: Optional[WizardClient] = None,
+    base_url: str = WIZARD_API_BASE,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> WizardSnapshot:
+    """Download a fresh catalog snapshot and save it to ``path``.
+
+    Without ``client`` a temporary one is created for ``base_url``, paced by
+    ``rate_limiter`` if given.
+    """
+    if client is None:
+        with WizardClient(base_url=base_url, rate_limiter=rate_limiter) as downloader:
+            snapshot = WizardSnapshot.download(downloader)
+    else:
+        snapshot = WizardSnapshot.download(client)
+    snapshot.save(path)
+    return snapshot
+
+
+def iter_potions(query: str) -> Iterator[PotionEntry]:
+    """Stream the potion rows for ``query`` from the shared client (see ``WizardClient.iter_potions``)."""
+    return get_wizard_client().iter_potions(query)
+
+
+def wizard_lookup_many(queries: list, max_concurrency: int = LOOKUP_MANY_CONCURRENCY) -> list:
+    """Resolve many queries with bounded concurrency using the shared client."""
+    return get_wizard_client().lookup_many(queries, max_concurrency)
+
+
+async def _async_wizard_lookup(query: str) -> str:
+    """Async variant of ``_wizard_lookup`` that does not block the event loop."""
+    return await get_async_wizard_client().lookup(query)
+
+
+# LangChain tool wrapper; async agents get the non-blocking variant
+wizard_lookup = StructuredTool.from_function(func=_wizard_lookup, coroutine=_async_wizard_lookup)
 
 
 def _get_llm():
@@ -127,30 +2966,78 @@ class Agent(ABC):
     """Abstract agent interface."""
 
     @abstractmethod
-    def run(self, query: str) -> str:
+    def run(self, query: str) -> Union[str, LookupResult]:
         """Execute a query and return results."""
 
+    async def arun(self, query: str) -> Union[str, LookupResult]:
+        """Execute a query without blocking the event loop.
+
+        The default runs ``run`` in a worker thread; subclasses with native
+        async I/O should override it.
+        """
+        return await asyncio.to_thread(self.run, query)
+
+    def stream(self, query: str) -> Iterator[Union[str, PotionEntry]]:
+        """Yield results as they become available; the default yields ``run``'s result."""
+        yield self.run(query)
+
 
 class HybridAgent(Agent):
     """Agent that tries direct tool lookup first, then falls back to LLM."""
 
-    def __init__(self, llm_agent: Any):
+    def __init__(
+        self,
+        llm_agent: Any,
+        client: Optional[WizardClient] = None,
+        query_log: Optional[QueryLog] = None,
+    ):
         self.llm_agent = llm_agent
-
-    def run(self, query: str) -> str:
-        """Execute query, preferring direct tool results if available."""
+        self.client = client if client is not None else get_wizard_client()
+        self.query_log = query_log
+        self._async_client: Optional[AsyncWizardClient] = None
+
+    @property
+    def async_client(self) -> AsyncWizardClient:
+        """Async client sharing this agent's Wizard API configuration."""
+        if self._async_client is None:
+            self._async_client = AsyncWizardClient(self.client)
+        return self._async_client
+
+    def run(self, query: str) -> Union[str, LookupResult]:
+        """Execute query, preferring direct tool results if available.
+
+        Direct hits are returned as a ``LookupResult``; LLM answers as text.
+        """
         # Try direct tool lookup first
-        tool_result = _wizard_lookup(query)
-        try:
-            data = json.loads(tool_result)
-            if data.get("potions"):
-                return tool_result
-        except json.JSONDecodeError:
-            pass
+        result = self.client.lookup_result(query)
+        if result.potions:
+            if self.query_log is not None:
+                self.query_log.record(query)
+            return result
 
         # Fall back to LLM agent
         return self._run_llm_agent(query)
 
+    def stream(self, query: str) -> Iterator[Union[str, PotionEntry]]:
+        """Yield potion rows as the direct lookup produces them, else the LLM answer.
+
+        If the lookup fails after some rows were yielded, the stream ends there.
+        """
+        found = False
+        try:
+            for potion in self.client.iter_potions(query):
+                found = True
+                yield potion
+        except (WizardLookupError, requests.RequestException) as e:
+            logger.warning(f"Streaming wizard lookup failed: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error in streaming wizard lookup: {e}")
+        if found:
+            if self.query_log is not None:
+                self.query_log.record(query)
+            return
+        yield self._run_llm_agent(query)
+
     def _run_llm_agent(self, query: str) -> str:
         """Run the underlying LLM agent."""
         if hasattr(self.llm_agent, "run"):
@@ -167,8 +3054,36 @@ class HybridAgent(Agent):
 
         raise RuntimeError("LLM agent has no compatible interface")
 
+    async def arun(self, query: str) -> Union[str, LookupResult]:
+        """Async variant of ``run`` awaiting the tool lookup and LLM fallback."""
+        result = await self.async_client.lookup_result(query)
+        if result.potions:
+            if self.query_log is not None:
+                self.query_log.record(query)
+            return result
 
-def _build_initialize_agent_style() -> Agent:
+        return await self._arun_llm_agent(query)
+
+    async def _arun_llm_agent(self, query: str) -> str:
+        """Run the underlying LLM agent, using its native async API when present."""
+        if hasattr(self.llm_agent, "arun"):
+            return await self.llm_agent.arun(query)
+
+        if hasattr(self.llm_agent, "astream"):
+            parts = []
+            async for chunk in self.llm_agent.astream(
+                {"messages": [{"role": "user", "content": query}]},
+                stream_mode="updates",
+            ):
+                parts.append(str(chunk))
+            return "".join(parts)
+
+        return await asyncio.to_thread(self._run_llm_agent, query)
+
+
+def _build_initialize_agent_style(
+    client: Optional[WizardClient] = None, query_log: Optional[QueryLog] = None
+) -> Agent:
     """Build agent using older LangChain initialize_agent API."""
     from langchain.agents import AgentType, initialize_agent
 
@@ -180,10 +3095,12 @@ def _build_initialize_agent_style() -> Agent:
         agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
         verbose=False,
     )
-    return HybridAgent(agent)
+    return HybridAgent(agent, client, query_log)
 
 
-def _build_create_agent_style() -> Agent:
+def _build_create_agent_style(
+    client: Optional[WizardClient] = None, query_log: Optional[QueryLog] = None
+) -> Agent:
     """Build agent using newer LangChain create_agent API."""
     from langchain.agents import create_agent
 
@@ -192,41 +3109,76 @@ def _build_create_agent_style() -> Agent:
         tools=[_wizard_lookup],
         system_prompt="You are a helpful assistant",
     )
-    return HybridAgent(agent)
+    return HybridAgent(agent, client, query_log)
+
 
+def build_agent(
+    client: Optional[WizardClient] = None,
+    warmup: Optional[list] = None,
+    query_log: Optional[QueryLog] = None,
+    warmup_top_n: int = WARMUP_TOP_N,
+) -> Agent:
+    """Build and return an agent, trying multiple LangChain versions.
 
-def build_agent() -> Agent:
-    """Build and return an agent, trying multiple LangChain versions."""
+    Args:
+        client: Wizard API client to use; defaults to the shared process-wide one.
+        warmup: Queries to look up in the background while the agent starts.
+            Passing a list, even an empty one, also warms the connection pool.
+        query_log: Log that successful lookups are recorded to; its
+            ``warmup_top_n`` most frequent queries are prewarmed as well.
+    """
     _check_api_key()
 
+    queries = list(warmup or [])
+    if query_log is not None and warmup_top_n > 0:
+        queries += query_log.top(warmup_top_n)
+    if warmup is not None or queries:
+        (client if client is not None else get_wizard_client()).prewarm(queries)
+
     # Try newer API first
     try:
-        return _build_initialize_agent_style()
+        return _build_initialize_agent_style(client, query_log)
     except Exception as e:
         logger.debug(f"initialize_agent style failed: {e}, trying create_agent")
 
     try:
-        return _build_create_agent_style()
+        return _build_create_agent_style(client, query_log)
     except Exception as e:
         raise RuntimeError(f"Failed to build agent with any available API: {e}")
 
 
-def format_output(text: str) -> str:
-    """Format output, pretty-printing JSON when possible."""
+def format_output(result: Union[str, LookupResult], grouped: bool = False) -> str:
+    """Format output, pretty-printing lookup results and JSON text."""
+    if isinstance(result, LookupResult):
+        return _json_codec.dumps_pretty(result.to_dict(grouped))
     try:
-        data = json.loads(text)
-        return json.dumps(data, indent=2, ensure_ascii=False)
+        data = _json_loads(result)
+        return _json_codec.dumps_pretty(data)
     except json.JSONDecodeError:
-        return text
+        return result
+
+
+def format_stream_item(item: Union[str, PotionEntry]) -> str:
+    """Format one streamed item as an NDJSON line."""
+    if isinstance(item, PotionEntry):
+        return _json_dumps(item.to_dict())
+    return _json_dumps({"answer": item})
 
 
-def run_query(agent: Agent, query: str) -> None:
-    """Run a single query and print formatted result."""
+def run_query(agent: Agent, query: str, grouped: bool = False, stream: bool = False) -> None:
+    """Run a single query and print formatted result.
+
+    With ``stream`` each potion is printed as an NDJSON line as soon as it arrives.
+    """
+    if stream:
+        for item in agent.stream(query):
+            print(format_stream_item(item), flush=True)
+        return
     result = agent.run(query)
-    print(format_output(result))
+    print(format_output(result, grouped))
 
 
-def run_repl(agent: Agent) -> None:
+def run_repl(agent: Agent, grouped: bool = False, stream: bool = False) -> None:
     """Run interactive REPL."""
     print("Starting REPL (Ctrl+D or empty line to quit)")
     while True:
@@ -239,8 +3191,7 @@ def run_repl(agent: Agent) -> None:
         if not user_input:
             break
 
-        result = agent.run(user_input)
-        print(format_output(result))
+        run_query(agent, user_input, grouped, stream)
 
 
 def main() -> None:
@@ -248,14 +3199,223 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Simple LangChain agent")
     parser.add_argument("--query", "-q", help="Single query to run")
     parser.add_argument("--repl", action="store_true", help="Start interactive REPL")
+    parser.add_argument(
+        "--api-base",
+        default=WIZARD_API_BASE,
+        help="Wizard World API base URL (default: $WIZARD_API_BASE or the public API)",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=WIZARD_POOL_SIZE,
+        help="Max pooled keep-alive connections to the Wizard API",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="Directory for the persistent lookup cache (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Disable the in-memory and on-disk lookup caches"
+    )
+    parser.add_argument(
+        "--snapshot",
+        nargs="?",
+        const="",
+        metavar="PATH",
+        help=f"Serve lookups from a local catalog snapshot (default: <cache-dir>/{SNAPSHOT_FILENAME})",
+    )
+    parser.add_argument(
+        "--refresh-snapshot",
+        action="store_true",
+        help="Download all wizards and elixirs into the snapshot file (and the SQLite source)",
+    )
+    parser.add_argument(
+        "--source",
+        choices=WIZARD_SOURCES,
+        default=WIZARD_SOURCE,
+        help="Where wizard records come from (default: $WIZARD_SOURCE or %(default)s)",
+    )
+    parser.add_argument(
+        "--source-path",
+        metavar="PATH",
+        help=f"Snapshot, SQLite database or fixture JSON for --source (default: <cache-dir>/{WIZARD_DB_FILENAME} for sqlite)",
+    )
+    parser.add_argument(
+        "--json-backend",
+        choices=JSON_BACKENDS,
+        default=WIZARD_JSON_BACKEND,
+        help="JSON encoder/decoder; auto picks orjson when installed (default: $WIZARD_JSON_BACKEND or %(default)s)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Fixed Wizard API timeout in seconds (default: adaptive, derived from observed latency)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=RETRY_MAX_ATTEMPTS - 1,
+        help="Extra attempts for transient Wizard API errors (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help=f"Send a backup request when a lookup exceeds the p{HEDGE_PERCENTILE:g} latency",
+    )
+    parser.add_argument(
+        "--hydrate",
+        action="store_true",
+        help="Fetch elixir details so potion descriptions are filled in",
+    )
+    parser.add_argument(
+        "--no-fuzzy",
+        action="store_true",
+        help="Do not fall back to fuzzy name matching against the local snapshot",
+    )
+    parser.add_argument(
+        "--no-prefilter",
+        action="store_true",
+        help="Do not skip API calls for queries the local snapshot rules out as wizard names",
+    )
+    output_mode = parser.add_mutually_exclusive_group()
+    output_mode.add_argument(
+        "--grouped",
+        action="store_true",
+        help="Print lookups as {wizard: [potion ids]} plus a table of distinct potions",
+    )
+    output_mode.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print each potion as an NDJSON line as soon as it arrives",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=RATE_LIMIT_PER_SECOND,
+        metavar="RPS",
+        help="Max requests per second to each API endpoint, 0 to disable (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--warmup",
+        action="append",
+        metavar="QUERY",
+        help="Look up QUERY in the background on startup (repeatable)",
+    )
+    parser.add_argument(
+        "--warmup-top",
+        type=int,
+        default=WARMUP_TOP_N,
+        metavar="N",
+        help="In the REPL, prewarm the N most frequent queries from the query log (default: %(default)s)",
+    )
     args = parser.parse_args()
 
-    agent = build_agent()
+    try:
+        # argparse does not check an environment default against ``choices``
+        set_json_backend(args.json_backend)
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
+    if args.source not in WIZARD_SOURCES:
+        parser.error(f"invalid $WIZARD_SOURCE {args.source!r} (choose from {', '.join(WIZARD_SOURCES)})")
+    if args.snapshot is not None:
+        args.source = "snapshot"
+    if args.source == "fixture" and not args.source_path:
+        parser.error("--source fixture requires --source-path")
+    rate_limiter = RateLimiter(rate=args.rate_limit) if args.rate_limit > 0 else None
+    snapshot_path = (
+        args.snapshot
+        or (args.source_path if args.source == "snapshot" else None)
+        or os.path.join(args.cache_dir, SNAPSHOT_FILENAME)
+    )
+    db_path = args.source_path or os.path.join(args.cache_dir, WIZARD_DB_FILENAME)
+    if args.refresh_snapshot:
+        snapshot = refresh_snapshot(snapshot_path, base_url=args.api_base, rate_limiter=rate_limiter)
+        print(
+            f"Saved {len(snapshot.wizards)} wizards and {len(snapshot.elixirs)} elixirs"
+            f" to {snapshot_path}"
+        )
+        if args.source == "sqlite":
+            SQLiteWizardSource(db_path).import_snapshot(snapshot)
+            print(f"Imported the snapshot into {db_path}")
+        if not (args.query or args.repl):
+            return
+
+    source = None
+    if args.source == "sqlite":
+        if not os.path.exists(db_path):
+            if not os.path.exists(snapshot_path):
+                parser.error(f"No wizard database at {db_path}; create it with --refresh-snapshot")
+            SQLiteWizardSource(db_path).import_snapshot(WizardSnapshot.load(snapshot_path))
+        source = SQLiteWizardSource(db_path)
+    elif args.source == "fixture":
+        source = InMemoryWizardSource.from_file(args.source_path)
+    elif args.source == "snapshot":
+        if not os.path.exists(snapshot_path):
+            parser.error(f"No snapshot at {snapshot_path}; create it with --refresh-snapshot")
+        source = SnapshotWizardSource(WizardSnapshot.load(snapshot_path))
+
+    fuzzy_index = None
+    prefilter = None
+    if not (args.no_fuzzy and args.no_prefilter):
+        # Typos are resolved and non-wizards skipped against the selected source's catalog;
+        # the HTTP API has none locally, so it uses the snapshot file if there is one
+        if source is not None:
+            catalog = source.catalog()
+        elif os.path.exists(snapshot_path):
+            catalog = WizardSnapshot.load(snapshot_path).wizards
+        else:
+            catalog = None
+        if catalog is not None:
+            fuzzy_index = FuzzyNameIndex(catalog)
+            if not args.no_prefilter:
+                prefilter = NameBloomFilter.from_wizards(catalog)
+
+    if args.no_cache:
+        client = WizardClient(
+            base_url=args.api_base,
+            timeout=args.timeout,
+            pool_size=args.pool_size,
+            fuzzy_index=fuzzy_index,
+            prefilter=prefilter,
+            rate_limiter=rate_limiter,
+            source=source,
+        )
+    else:
+        client = WizardClient(
+            base_url=args.api_base,
+            timeout=args.timeout,
+            pool_size=args.pool_size,
+            cache=LookupCache(stale_ttl=STALE_IF_ERROR),
+            # Local sources are already persistent and fast; only API results go to disk
+            disk_cache=(
+                DiskLookupCache.in_dir(args.cache_dir, stale_ttl=STALE_IF_ERROR) if source is None else None
+            ),
+            fuzzy_index=fuzzy_index,
+            negative_cache=LookupCache(max_entries=NEGATIVE_CACHE_MAX_ENTRIES, ttl=NEGATIVE_CACHE_TTL),
+            prefilter=prefilter,
+            rate_limiter=rate_limiter,
+            source=source,
+        )
+    if args.no_fuzzy:
+        client.fuzzy_index = None
+    if args.hedge:
+        client.hedge = HedgePolicy()
+    client.hydrate = args.hydrate
+    client.retry = RetryPolicy(max_attempts=args.retries + 1)
+    set_wizard_client(client)
+    query_log = None if args.no_cache else QueryLog.in_dir(args.cache_dir, client.source.scope)
+    agent = build_agent(
+        client,
+        warmup=(args.warmup or []) if args.repl else args.warmup,
+        query_log=query_log,
+        warmup_top_n=args.warmup_top if args.repl else 0,
+    )
 
     if args.query:
-        run_query(agent, args.query)
+        run_query(agent, args.query, args.grouped, args.stream)
     elif args.repl:
-        run_repl(agent)
+        run_repl(agent, args.grouped, args.stream)
     else:
         parser.print_help()
 
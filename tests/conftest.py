@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src import agent as agent_mod
+from tests.wizard_api_stub import WizardAPIStub
+
+
+@pytest.fixture(scope="session")
+def wizard_api():
+    """A local Wizard World API stand-in serving the fixture dataset."""
+    with WizardAPIStub() as stub:
+        yield stub
+
+
+@pytest.fixture
+def stub_client(wizard_api):
+    """Install a ``WizardClient`` pointed at the stand-in as the shared client."""
+    previous = agent_mod._default_client
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url)
+    agent_mod.set_wizard_client(client)
+    yield client
+    client.close()
+    agent_mod.set_wizard_client(previous)
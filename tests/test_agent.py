@@ -1,7 +1,11 @@
+import asyncio
 import json
 import sys
+import time
 from pathlib import Path
 
+import pytest
+
 # Ensure project root is on sys.path so `src` can be imported by pytest
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT))
@@ -9,7 +13,7 @@ sys.path.insert(0, str(ROOT))
 from src import agent as agent_mod
 
 
-def test_wizard_lookup_schema():
+def test_wizard_lookup_schema(stub_client):
     out = agent_mod._wizard_lookup("Dumbledore")
     parsed = json.loads(out)
     assert "query" in parsed
@@ -24,3 +28,1000 @@ def test_wizard_lookup_schema():
         assert "wizard" in item
         assert "potion_name" in item
         assert "potion_description" in item
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise agent_mod.requests.HTTPError(f"{self.status_code} error", response=self)
+
+    def json(self):
+        return self._payload
+
+    @property
+    def content(self):
+        return json.dumps(self._payload).encode("utf-8")
+
+    def iter_content(self, chunk_size=1):
+        body = json.dumps(self._payload).encode("utf-8")
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+WIZARDS = [
+    {
+        "id": "w1",
+        "firstName": "Albus",
+        "lastName": "Dumbledore",
+        "elixirs": [{"id": "e1", "name": "First Love Beguiling Bubbles"}],
+    },
+]
+
+
+def test_client_sessions_share_connection_pool(monkeypatch):
+    calls = []
+
+    def fake_get(self, url, timeout=None, **kwargs):
+        calls.append((self, url))
+        return FakeResponse(WIZARDS)
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", fake_get)
+    client = agent_mod.WizardClient(base_url="http://wizards.test", pool_size=3)
+
+    sessions = []
+    thread = agent_mod.threading.Thread(target=lambda: sessions.append(client.session))
+    thread.start()
+    thread.join()
+
+    assert sessions[0] is not client.session
+    assert sessions[0].get_adapter("http://wizards.test") is client.session.get_adapter(
+        "http://wizards.test"
+    )
+
+    parsed = json.loads(client.lookup(" Dumbledore "))
+    assert parsed["query"] == "Dumbledore"
+    assert parsed["potions"][0]["wizard"] == "Albus"
+    assert calls[0][1] == "http://wizards.test/wizards?name=Dumbledore"
+
+
+class FakeLLMAgent:
+    def __init__(self):
+        self.queries = []
+
+    def run(self, query):
+        self.queries.append(query)
+        return f"llm: {query}"
+
+    async def arun(self, query):
+        self.queries.append(query)
+        return f"llm: {query}"
+
+
+def test_hybrid_agent_arun_uses_async_lookup_and_llm_fallback():
+    import httpx
+
+    def handler(request):
+        if request.url.params["name"] == "Dumbledore":
+            return httpx.Response(200, json=WIZARDS)
+        return httpx.Response(200, json=[])
+
+    client = agent_mod.WizardClient(base_url="http://wizards.test")
+    llm = FakeLLMAgent()
+    hybrid = agent_mod.HybridAgent(llm, client)
+    hybrid._async_client = agent_mod.AsyncWizardClient(client, transport=httpx.MockTransport(handler))
+
+    async def scenario():
+        return await asyncio.gather(hybrid.arun("Dumbledore"), hybrid.arun("What is 12 * 7?"))
+
+    hit, fallback = asyncio.run(scenario())
+    assert isinstance(hit, agent_mod.LookupResult)
+    assert hit.potions[0].potion_name == "First Love Beguiling Bubbles"
+    assert fallback == "llm: What is 12 * 7?"
+    assert llm.queries == ["What is 12 * 7?"]
+
+
+def test_lookup_cache_ttl_lru_and_byte_limits():
+    now = [0.0]
+    cache = agent_mod.LookupCache(max_entries=2, max_bytes=64, ttl=10, clock=lambda: now[0])
+
+    cache.set("a", [1])
+    cache.set("b", [2])
+    assert cache.get("a") == [1]
+    cache.set("c", [3])  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    cache.set("big", ["x" * 100])  # larger than max_bytes, never stored
+    assert cache.get("big") is None
+
+    now[0] = 11.0
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["evictions"] == 1
+    assert stats["expirations"] == 1
+    assert stats["entries"] == 1
+
+
+def test_lookup_cache_sizes_entries_without_encoding_them(monkeypatch):
+    potions = [
+        agent_mod.PotionEntry("Severus", agent_mod.PotionRecord.intern(f"e{i}", f"Potion {i}", "Brewed slowly"))
+        for i in range(20)
+    ]
+    encoded = len(agent_mod._json_dumps([p.to_dict() for p in potions]))
+    assert abs(agent_mod._approx_json_size(potions) - encoded) <= encoded * 0.1
+
+    def no_encoding(obj):
+        raise AssertionError("cache fills must not JSON-encode values")
+
+    monkeypatch.setattr(agent_mod, "_json_dumps", no_encoding)
+    cache = agent_mod.LookupCache()
+    cache.set("snape", potions)
+    assert cache.get("snape") is potions
+
+
+def test_client_lookup_cache_uses_normalized_keys(monkeypatch):
+    calls = []
+
+    def fake_get(self, url, timeout=None, **kwargs):
+        calls.append(url)
+        return FakeResponse(WIZARDS)
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", fake_get)
+    client = agent_mod.WizardClient(base_url="http://wizards.test", cache=agent_mod.LookupCache())
+
+    first = json.loads(client.lookup("Dumbledore"))
+    second = json.loads(client.lookup("  dumbledore "))
+    assert len(calls) == 1
+    assert second["query"] == "dumbledore"
+    assert second["potions"] == first["potions"]
+
+
+def test_disk_cache_shared_between_instances_with_ttl_and_size_limit(tmp_path):
+    now = [1000.0]
+    path = str(tmp_path / "cache" / "lookups.sqlite3")
+    writer = agent_mod.DiskLookupCache(path, ttl=60, max_bytes=40, clock=lambda: now[0])
+    reader = agent_mod.DiskLookupCache(path, ttl=60, max_bytes=40, clock=lambda: now[0])
+
+    writer.set("albus", [{"potion_name": "a"}])
+    assert reader.get("albus") == [{"potion_name": "a"}]
+
+    now[0] += 1
+    writer.set("harry", [{"potion_name": "b"}])  # over max_bytes, evicts "albus"
+    assert reader.get("albus") is None
+    assert reader.get("harry") == [{"potion_name": "b"}]
+
+    now[0] += 61
+    assert reader.get("harry") is None
+    writer.close()
+    reader.close()
+
+
+def test_snapshot_roundtrip_serves_lookups_without_http(tmp_path, monkeypatch):
+    catalog = WIZARDS + [
+        {"id": "w2", "firstName": "Harry", "lastName": "Potter", "elixirs": []},
+        {"id": "w3", "firstName": None, "lastName": "Dumbledore-ish", "elixirs": [{"id": "e2", "name": "X"}]},
+    ]
+
+    def fake_get(self, url, timeout=None, **kwargs):
+        if url.endswith("/wizards"):
+            return FakeResponse(catalog)
+        if url.endswith("/elixirs"):
+            return FakeResponse([{"id": "e1", "name": "First Love Beguiling Bubbles"}])
+        raise AssertionError(f"unexpected request {url}")
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", fake_get)
+    path = str(tmp_path / "snapshot.json.gz")
+    agent_mod.refresh_snapshot(path, agent_mod.WizardClient(base_url="http://wizards.test"))
+
+    def no_http(self, url, timeout=None, **kwargs):
+        raise AssertionError("snapshot lookups must not hit the network")
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", no_http)
+    snapshot = agent_mod.WizardSnapshot.load(path)
+    assert len(snapshot.elixirs) == 1
+    client = agent_mod.WizardClient(snapshot=snapshot)
+
+    parsed = json.loads(client.lookup("dumbledore"))
+    assert [p["potion_name"] for p in parsed["potions"]] == ["First Love Beguiling Bubbles", "X"]
+    assert json.loads(client.lookup("Snape")) == {"query": "Snape", "potions": []}
+
+
+def test_name_index_matches_linear_substring_filter():
+    wizards = [
+        {"firstName": "Albus", "lastName": "Dumbledore"},
+        {"firstName": "Aberforth", "lastName": "Dumbledore"},
+        {"firstName": "Harry", "lastName": "Potter"},
+        {"firstName": None, "lastName": "Slughorn"},
+        {"firstName": "Élodie", "lastName": "Àbrams"},
+    ]
+    index = agent_mod.WizardNameIndex(wizards)
+    for query in ["a", "AL", "dum", "dumbledore", "ore", "rry po", "slug", "élo", "zzz", "bus"]:
+        expected = [w for w in wizards if agent_mod._wizard_matches(w, query.casefold())]
+        assert index.search(query) == expected, query
+
+
+def test_fuzzy_index_resolves_misspelled_names():
+    wizards = WIZARDS + [
+        {"id": "w2", "firstName": "Harry", "lastName": "Potter", "elixirs": []},
+        {"id": "w3", "firstName": "Aberforth", "lastName": "Dumbledore", "elixirs": []},
+    ]
+    index = agent_mod.FuzzyNameIndex(wizards, top_k=2)
+
+    matches = index.search("Dumbeldore")
+    assert {w["id"] for _score, w in matches} == {"w1", "w3"}
+    assert index.search("Hary Poter")[0][1]["id"] == "w2"
+    assert index.search("What is 12 * 7?") == []
+
+    client = agent_mod.WizardClient(snapshot=agent_mod.WizardSnapshot(wizards, []))
+    parsed = json.loads(client.lookup("Dumbeldore"))
+    assert parsed["fuzzy"] is True
+    assert parsed["potions"][0]["potion_name"] == "First Love Beguiling Bubbles"
+
+
+def test_concurrent_identical_lookups_share_one_request(monkeypatch):
+    calls = []
+    release = agent_mod.threading.Event()
+
+    def slow_get(self, url, timeout=None, **kwargs):
+        calls.append(url)
+        release.wait(5)
+        return FakeResponse(WIZARDS)
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", slow_get)
+    client = agent_mod.WizardClient(base_url="http://wizards.test")
+
+    results = []
+    threads = [
+        agent_mod.threading.Thread(target=lambda q=q: results.append(json.loads(client.lookup(q))))
+        for q in ["Dumbledore", "dumbledore", " DUMBLEDORE"]
+    ]
+    for thread in threads:
+        thread.start()
+    while client.inflight.stats()["shared"] < 2:
+        agent_mod.time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(len(r["potions"]) == 1 for r in results)
+
+
+def test_async_singleflight_shares_result():
+    flight = agent_mod.AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["result"] * 5
+    assert calls == [1]
+    assert flight.stats() == {"executed": 1, "shared": 4}
+
+
+def test_wizard_lookup_many_dedupes_and_keeps_input_order(monkeypatch):
+    calls = []
+
+    def fake_get(self, url, timeout=None, **kwargs):
+        calls.append(url)
+        if "Snape" in url:
+            raise agent_mod.requests.ConnectionError("boom")
+        if "Dumbledore" in url:
+            return FakeResponse(WIZARDS)
+        return FakeResponse([])
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", fake_get)
+    client = agent_mod.WizardClient(
+        base_url="http://wizards.test", retry=agent_mod.RetryPolicy(max_attempts=1)
+    )
+
+    results = client.lookup_many(["Dumbledore", "Snape", "dumbledore ", "Nobody"], max_concurrency=2)
+
+    assert [r["query"] for r in results] == ["Dumbledore", "Snape", "dumbledore", "Nobody"]
+    assert len(results[0]["potions"]) == 1 and results[2]["potions"] == results[0]["potions"]
+    assert "error" in results[1]
+    assert results[3] == {"query": "Nobody", "potions": []}
+    assert len(calls) == 3
+
+
+def test_circuit_breaker_opens_fails_fast_and_probes():
+    now = [0.0]
+    breaker = agent_mod.CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(agent_mod.CircuitOpenError):
+        breaker.before_call()
+
+    now[0] = 10.0
+    assert breaker.state == "half_open"
+    breaker.before_call()  # the single probe
+    with pytest.raises(agent_mod.CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 20.0
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.stats()["state"] == "closed"
+
+
+def test_client_fails_fast_while_circuit_open(monkeypatch):
+    calls = []
+
+    def down(self, url, timeout=None, **kwargs):
+        calls.append(url)
+        raise agent_mod.requests.Timeout("timed out")
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", down)
+    client = agent_mod.WizardClient(
+        base_url="http://wizards.test", breaker=agent_mod.CircuitBreaker(failure_threshold=2)
+    )
+
+    for _ in range(4):
+        parsed = json.loads(client.lookup("Dumbledore"))
+    assert len(calls) == 2
+    assert parsed["error"].startswith("API unavailable")
+    assert client.metrics()["circuit"]["state"] == "open"
+
+
+def test_hedged_request_wins_over_stalled_primary(monkeypatch):
+    calls = []
+    stall = agent_mod.threading.Event()
+
+    def stalling_get(self, url, timeout=None, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            stall.wait(5)
+        return FakeResponse(WIZARDS)
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", stalling_get)
+    hedge = agent_mod.HedgePolicy(min_samples=5, max_ratio=1.0)
+    client = agent_mod.WizardClient(base_url="http://wizards.test", hedge=hedge)
+    for _ in range(5):
+        client.latency.record(0.01)
+
+    started = agent_mod.time.monotonic()
+    parsed = json.loads(client.lookup("Dumbledore"))
+    elapsed = agent_mod.time.monotonic() - started
+    assert hedge.stats()["in_flight"] == 1  # the stalled primary still holds the hedge slot
+    stall.set()
+    for _ in range(100):
+        if hedge.stats()["in_flight"] == 0:
+            break
+        agent_mod.time.sleep(0.01)
+    client.close()
+
+    assert parsed["potions"]
+    assert elapsed < 1
+    assert len(calls) == 2
+    assert hedge.stats()["hedge_wins"] == 1 and hedge.stats()["in_flight"] == 0
+
+
+def test_hedge_budget_caps_extra_requests():
+    hedge = agent_mod.HedgePolicy(max_ratio=0.1, min_samples=0)
+    latency = agent_mod.LatencyTracker()
+    latency.record(0.2)
+    for _ in range(9):
+        hedge.delay(latency)
+    assert not hedge.try_acquire()
+    hedge.delay(latency)
+    assert hedge.try_acquire()
+    assert not hedge.try_acquire()
+
+
+def test_adaptive_timeouts_follow_latency_within_bounds():
+    latency = agent_mod.LatencyTracker()
+    timeouts = agent_mod.AdaptiveTimeout(latency, min_samples=3)
+
+    assert timeouts.current() == (timeouts.connect_ceiling, timeouts.read_ceiling)
+    assert timeouts.stats()["source"] == "cold"
+
+    for _ in range(3):
+        latency.record(0.2)
+    assert timeouts.current() == (pytest.approx(0.6), pytest.approx(1.0))  # read clamped to floor
+
+    timeouts.record_timeout("read")
+    connect, read = timeouts.current()
+    assert (connect, read) == (pytest.approx(1.2), pytest.approx(1.6))
+    stats = timeouts.stats()
+    assert stats["source"] == "backoff" and stats["read_timeouts"] == 1
+
+    for _ in range(200):
+        latency.record(60.0)
+    timeouts.record_success()
+    assert timeouts.current() == (timeouts.connect_ceiling, timeouts.read_ceiling)
+
+
+def test_transient_errors_are_retried_within_budget(monkeypatch):
+    statuses = [503, 503, 200]
+    calls = []
+
+    def flaky_get(self, url, timeout=None, **kwargs):
+        calls.append(timeout)
+        return FakeResponse(WIZARDS, status_code=statuses[len(calls) - 1])
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", flaky_get)
+    retry = agent_mod.RetryPolicy(max_attempts=3, base_delay=0.001)
+    client = agent_mod.WizardClient(base_url="http://wizards.test", retry=retry)
+
+    assert json.loads(client.lookup("Dumbledore"))["potions"]
+    assert len(calls) == 3
+    assert retry.budget.stats()["retries"] == 2
+
+    # The budget (2 starting tokens, +0.1 per request) is now spent
+    calls.clear()
+    statuses[:] = [503, 200]
+    assert "error" in json.loads(client.lookup("Harry"))
+    assert len(calls) == 1
+    assert retry.budget.stats()["exhausted"] == 1
+
+
+def test_retries_respect_deadline(monkeypatch):
+    calls = []
+
+    def failing_get(self, url, timeout=None, **kwargs):
+        calls.append(timeout)
+        raise agent_mod.requests.ConnectionError("reset")
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", failing_get)
+    client = agent_mod.WizardClient(
+        base_url="http://wizards.test",
+        retry=agent_mod.RetryPolicy(max_attempts=5, base_delay=10, max_delay=10),
+    )
+
+    deadline = agent_mod.time.monotonic() + 0.5
+    parsed = json.loads(client.lookup("Dumbledore", deadline=deadline))
+    assert "error" in parsed
+    assert all(max(timeout) <= 0.5 for timeout in calls)
+    assert agent_mod.time.monotonic() < deadline
+
+
+def test_json_array_stream_parses_split_chunks():
+    stream = agent_mod.JSONArrayStream()
+    body = json.dumps([{"a": "x]y"}, 12, [1, 2], "s", {"b": {"c": [3]}}])
+    items = []
+    for start in range(0, len(body), 3):
+        items.extend(stream.feed(body[start:start + 3]))
+    items.extend(stream.close())
+    assert items == [{"a": "x]y"}, 12, [1, 2], "s", {"b": {"c": [3]}}]
+
+    with pytest.raises(ValueError):
+        truncated = agent_mod.JSONArrayStream()
+        truncated.feed('[{"a": 1}, {"b"')
+        truncated.close()
+
+
+def test_broad_lookup_stops_reading_after_max_results(monkeypatch):
+    many = [
+        {"id": str(i), "firstName": f"Wizard {i}", "elixirs": [{"name": f"Elixir {i}"}]}
+        for i in range(1000)
+    ]
+    consumed = []
+
+    class CountingResponse(FakeResponse):
+        def iter_content(self, chunk_size=1):
+            for chunk in super().iter_content(chunk_size):
+                consumed.append(len(chunk))
+                yield chunk
+
+    def fake_get(self, url, timeout=None, stream=False, **kwargs):
+        assert stream
+        return CountingResponse(many)
+
+    monkeypatch.setattr(agent_mod.requests.Session, "get", fake_get)
+    client = agent_mod.WizardClient(base_url="http://wizards.test")
+
+    parsed = json.loads(client.lookup("a"))
+    assert [p["wizard"] for p in parsed["potions"]] == [f"Wizard {i}" for i in range(5)]
+    assert sum(consumed) == agent_mod.STREAM_CHUNK_SIZE < len(json.dumps(many))
+
+
+@pytest.mark.skipif(agent_mod.orjson is None, reason="orjson not installed")
+def test_orjson_codec_is_byte_identical_to_stdlib():
+    fast, std = agent_mod.OrjsonCodec(), agent_mod.JSONCodec()
+    samples = [
+        {"query": "Dumbledore", "potions": [{"wizard": "Albus", "potion_name": "Élixir \"😀\"\n\x00"}]},
+        {"query": "", "potions": [], "error": "Please provide a search query"},
+        {"nested": {"empty": [], "obj": {}}, "n": None, "t": True, "i": 2**70},
+        {"floats": [1e-7, 0.1, 1e16, -0.0]},
+        {1: "non-string key"},
+        [],
+    ]
+    for sample in samples:
+        assert fast.dumps(sample) == std.dumps(sample)
+        assert fast.dumps_pretty(sample) == std.dumps_pretty(sample)
+        assert fast.loads(std.dumps(sample)) == std.loads(std.dumps(sample))
+    for text in ["123456789012345678901234567890", "-9223372036854775809", "1e400", "NaN", "[1.5, 2]"]:
+        assert fast.dumps_pretty(fast.loads(text)) == std.dumps_pretty(std.loads(text)), text
+    with pytest.raises(json.JSONDecodeError):
+        fast.loads("What is 12 * 7?")
+
+
+def test_json_backend_can_be_selected(stub_client):
+    expected = agent_mod._wizard_lookup("Snape")
+    try:
+        for name, codec in [("json", agent_mod.JSONCodec), ("orjson", agent_mod.OrjsonCodec)]:
+            assert type(agent_mod.set_json_backend(name)) is codec
+            assert agent_mod._json_codec.name == name
+            assert agent_mod._wizard_lookup("Snape") == expected
+        with pytest.raises(ValueError):
+            agent_mod.set_json_backend("ujson")
+    finally:
+        agent_mod.set_json_backend("auto")
+    assert agent_mod.WIZARD_JSON_BACKEND in agent_mod.JSON_BACKENDS
+
+
+def test_invalid_json_backend_default_is_a_usage_error(monkeypatch, capsys):
+    monkeypatch.setattr(agent_mod, "WIZARD_JSON_BACKEND", "ujson")
+    monkeypatch.setattr(sys, "argv", ["agent.py", "--query", "x"])
+    with pytest.raises(SystemExit) as exc:
+        agent_mod.main()
+    assert exc.value.code == 2
+    assert "Unknown JSON backend: ujson" in capsys.readouterr().err
+
+
+def test_invalid_source_default_is_a_usage_error(monkeypatch, capsys):
+    monkeypatch.setattr(agent_mod, "WIZARD_SOURCE", "bogus")
+    monkeypatch.setattr(sys, "argv", ["agent.py", "--query", "x"])
+    with pytest.raises(SystemExit) as exc:
+        agent_mod.main()
+    assert exc.value.code == 2
+    assert "invalid $WIZARD_SOURCE 'bogus'" in capsys.readouterr().err
+
+
+def test_stub_server_streams_slow_bodies_and_injects_errors():
+    from tests.wizard_api_stub import WizardAPIStub
+
+    with WizardAPIStub(chunk_size=64, chunk_delay=0.001) as slow:
+        client = agent_mod.WizardClient(base_url=slow.base_url)
+        parsed = json.loads(client.lookup("snape"))
+        assert [p["potion_name"] for p in parsed["potions"]][:2] == [
+            "Draught of Living Death",
+            "Wolfsbane Potion",
+        ]
+        assert len(client.get_json("/elixirs")) == len(slow.dataset["elixirs"])
+
+    with WizardAPIStub(error_rate=1.0) as failing:
+        client = agent_mod.WizardClient(
+            base_url=failing.base_url, retry=agent_mod.RetryPolicy(max_attempts=1)
+        )
+        assert "503" in json.loads(client.lookup("snape"))["error"]
+
+
+def test_hydration_fetches_each_elixir_once(wizard_api):
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url, hydrate=True)
+    before = len(wizard_api.requests)
+
+    results = client.lookup_many(["Snape", "Slughorn", "Potter"])
+    by_name = {
+        p["potion_name"]: p["potion_description"] for r in results for p in r["potions"]
+    }
+    assert by_name["Felix Felicis"] == "Makes the drinker lucky"
+    assert all(by_name.values())
+
+    elixir_requests = [path for path in wizard_api.requests[before:] if path.startswith("/elixirs/")]
+    assert len(elixir_requests) == len(set(elixir_requests)) == len(by_name)
+
+    async def again():
+        return await agent_mod.AsyncWizardClient(client).lookup("Granger")
+
+    parsed = json.loads(asyncio.run(again()))
+    assert {p["potion_description"] for p in parsed["potions"]} == {
+        "Allows the drinker to assume the form of someone else",
+        "Regrows bones",
+    }
+    assert sum(p.startswith("/elixirs/") for p in wizard_api.requests[before:]) == len(by_name) + 1
+
+
+def test_bloom_prefilter_has_no_false_negatives():
+    from tests.wizard_api_stub import load_fixture
+
+    wizards = load_fixture()["wizards"]
+    bloom = agent_mod.NameBloomFilter.from_wizards(wizards)
+    for wizard in wizards:
+        for name in (wizard["firstName"], wizard["lastName"]):
+            if name:
+                for start in range(len(name)):
+                    for end in range(start + 1, len(name) + 1):
+                        assert bloom.might_match(name[start:end].upper())
+    assert not bloom.might_match("What is 12 * 7?")
+    assert bloom.rejected == 1
+
+
+def test_negative_cache_and_prefilter_skip_http(wizard_api):
+    from tests.wizard_api_stub import load_fixture
+
+    client = agent_mod.WizardClient(
+        base_url=wizard_api.base_url,
+        negative_cache=agent_mod.LookupCache(ttl=60),
+        prefilter=agent_mod.NameBloomFilter.from_wizards(load_fixture()["wizards"]),
+    )
+    before = len(wizard_api.requests)
+
+    assert json.loads(client.lookup("What is 12 * 7?"))["potions"] == []
+    assert len(wizard_api.requests) == before
+
+    assert json.loads(client.lookup("Aberforth"))["potions"] == []  # a wizard without elixirs
+    assert json.loads(client.lookup("aberforth "))["potions"] == []
+    assert len(wizard_api.requests) == before + 1
+    assert client.metrics()["negative_cache"]["hits"] == 1
+
+
+def test_stale_entries_revalidate_in_background_and_cover_errors(wizard_api):
+    now = [0.0]
+    cache = agent_mod.LookupCache(ttl=10, clock=lambda: now[0], stale_ttl=3600)
+    client = agent_mod.WizardClient(
+        base_url=wizard_api.base_url, cache=cache, stale_while_revalidate=60, stale_if_error=3600
+    )
+    fresh = json.loads(client.lookup("Snape"))
+    assert fresh["potions"] and "stale" not in fresh
+    before = len(wizard_api.requests)
+
+    now[0] = 30.0  # expired, but within the revalidation window
+    stale = json.loads(client.lookup("Snape"))
+    assert stale["stale"] is True and stale["potions"] == fresh["potions"]
+    client._refresh_executor.shutdown(wait=True)
+    assert len(wizard_api.requests) == before + 1
+    assert json.loads(client.lookup("Snape")) == fresh
+
+    def down(name, deadline=None):
+        raise agent_mod.requests.ConnectionError("connection refused")
+
+    now[0] = 1000.0  # too old to serve without asking upstream, which is down
+    client.source.search_wizards = down
+    fallback = json.loads(client.lookup("Snape"))
+    assert fallback["stale"] is True and fallback["potions"] == fresh["potions"]
+
+    now[0] = 10000.0
+    assert "error" in json.loads(client.lookup("Snape"))
+
+
+def test_prewarm_fills_cache_from_query_log(wizard_api, tmp_path):
+    query_log = agent_mod.QueryLog.in_dir(str(tmp_path), wizard_api.base_url)
+    assert agent_mod.QueryLog.in_dir(str(tmp_path), "https://other.test").path != query_log.path
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url, cache=agent_mod.LookupCache())
+    agent = agent_mod.HybridAgent(FakeLLMAgent(), client, query_log)
+    for query in ("Snape", "Granger", "snape ", "Not A Wizard 42"):
+        agent.run(query)
+    assert query_log.top(1) == ["snape"]
+    assert set(query_log.top()) == {"snape", "granger"}
+
+    warm = agent_mod.WizardClient(base_url=wizard_api.base_url, cache=agent_mod.LookupCache())
+    before = len(wizard_api.requests)
+    warm.prewarm(query_log.top(), connections=2).join(timeout=5)
+    assert wizard_api.requests[before:].count(f"HEAD /") == 2
+    requests_after_warmup = len(wizard_api.requests)
+    assert json.loads(warm.lookup("Granger"))["potions"]
+    assert len(wizard_api.requests) == requests_after_warmup
+
+
+def test_rate_limiter_paces_each_endpoint_separately():
+    now = [0.0]
+    limiter = agent_mod.RateLimiter(rate=2, burst=2, clock=lambda: now[0])
+    waits = [limiter.reserve("/wizards?name=a") for _ in range(4)]
+    assert waits == [0.0, 0.0, 0.5, 1.0]
+    assert limiter.reserve("/elixirs/123") == 0.0
+
+    now[0] = 1.5
+    assert limiter.reserve("/wizards") == 0.0
+    with pytest.raises(agent_mod.DeadlineExceededError):
+        limiter.reserve("/wizards", deadline=time.monotonic() + 0.1)
+
+    stats = limiter.stats()
+    assert stats["/wizards"] == {"requests": 5, "delayed": 2, "wait_total": 1.5, "wait_max": 1.0}
+    assert stats["/elixirs"]["requests"] == 1
+
+
+def test_sync_and_async_clients_share_rate_limiter(wizard_api):
+    limiter = agent_mod.RateLimiter(rate=1000, burst=1)
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url, rate_limiter=limiter, hydrate=True)
+    assert json.loads(client.lookup("Snape"))["potions"]
+    asyncio.run(agent_mod.AsyncWizardClient(client).lookup("Granger"))
+
+    stats = client.metrics()["rate_limit"]
+    assert stats["/wizards"]["requests"] == 2
+    assert stats["/elixirs"]["requests"] >= 1
+    assert stats["/wizards"]["delayed"] + stats["/elixirs"]["delayed"] >= 1
+
+
+def test_wizard_sources_agree_with_http_api(wizard_api, tmp_path):
+    from tests.wizard_api_stub import load_fixture
+
+    dataset = load_fixture()
+    snapshot = agent_mod.WizardSnapshot(dataset["wizards"], dataset["elixirs"])
+    sqlite_source = agent_mod.SQLiteWizardSource(str(tmp_path / "wizards.sqlite3"))
+    sqlite_source.import_snapshot(snapshot)
+    sources = [
+        agent_mod.InMemoryWizardSource(dataset["wizards"], dataset["elixirs"]),
+        agent_mod.SnapshotWizardSource(snapshot),
+        sqlite_source,
+    ]
+
+    http = agent_mod.WizardClient(base_url=wizard_api.base_url, hydrate=True)
+    for query in ("Snape", "dumbledore", "Nobody"):
+        expected = json.loads(http.lookup(query))
+        for source in sources:
+            client = agent_mod.WizardClient(base_url="http://unused.test", source=source, hydrate=True)
+            assert json.loads(client.lookup(query)) == expected
+            assert json.loads(asyncio.run(agent_mod.AsyncWizardClient(client).lookup(query))) == expected
+    for source in sources:
+        assert source.catalog() == dataset["wizards"]
+    assert agent_mod.HTTPWizardSource(http).catalog() is None
+    sqlite_source.close()
+
+    client = agent_mod.WizardClient(base_url="http://unused.test", snapshot=snapshot, hydrate=True)
+    assert isinstance(client.source, agent_mod.SnapshotWizardSource)
+    assert list(client.iter_potions("Snape")) == client.lookup_result("Snape").potions
+
+
+def test_lookup_result_serializes_only_at_the_edges(wizard_api, tmp_path):
+    disk = agent_mod.DiskLookupCache(str(tmp_path / "cache.sqlite3"))
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url, cache=agent_mod.LookupCache(), disk_cache=disk)
+    agent = agent_mod.HybridAgent(FakeLLMAgent(), client)
+
+    result = agent.run("Snape")
+    assert isinstance(result, agent_mod.LookupResult)
+    assert all(isinstance(potion, agent_mod.PotionEntry) for potion in result.potions)
+    assert json.loads(agent_mod.format_output(result)) == json.loads(client.lookup("Snape"))
+    assert agent_mod.format_output(agent.run("What is 12 * 7?")) == "llm: What is 12 * 7?"
+
+    # Entries read back from disk are rebuilt as PotionEntry objects, but only for the same API
+    before = len(wizard_api.requests)
+    fresh = agent_mod.WizardClient(base_url=wizard_api.base_url, disk_cache=disk)
+    assert fresh.lookup_result("snape").potions == result.potions
+    assert len(wizard_api.requests) == before
+    assert agent_mod.WizardClient(base_url="http://other.test", disk_cache=disk)._cache_lookup("snape") is None
+    assert json.loads(agent_mod.wizard_lookup.func("")) == {
+        "query": "",
+        "potions": [],
+        "error": "Please provide a search query",
+    }
+
+
+def test_potion_records_are_shared_and_grouped_output_dedupes_them(tmp_path):
+    wizards = [
+        {"firstName": name, "elixirs": [{"id": "e1", "name": "Felix Felicis"}, {"id": "e2", "name": "Draught of Peace"}]}
+        for name in ("Albus", "Aberforth", "Ariana")
+    ]
+    potions = agent_mod._build_potions_list(wizards)
+    assert len(potions) == 6
+    assert potions[0].potion is potions[2].potion is potions[4].potion
+    with pytest.raises(AttributeError):
+        potions[0].potion.name = "changed"
+
+    result = agent_mod.LookupResult("dumbledore", potions)
+    assert result.to_dict(grouped=True) == {
+        "query": "dumbledore",
+        "wizards": {name: ["e1", "e2"] for name in ("Albus", "Aberforth", "Ariana")},
+        "potions": {
+            "e1": {"name": "Felix Felicis", "description": ""},
+            "e2": {"name": "Draught of Peace", "description": ""},
+        },
+    }
+    assert len(result.to_json(grouped=True)) < len(result.to_json())
+
+    disk = agent_mod.DiskLookupCache(str(tmp_path / "cache.sqlite3"))
+    agent_mod.WizardClient(base_url="http://unused.test", disk_cache=disk)._cache_put("dumbledore", potions)
+    cached = agent_mod.WizardClient(base_url="http://unused.test", disk_cache=disk).lookup_result("Dumbledore")
+    assert cached.potions == potions and cached.potions[1].potion is potions[1].potion
+
+
+def test_iter_potions_yields_rows_before_the_body_finishes(wizard_api):
+    from tests.wizard_api_stub import WizardAPIStub
+
+    expected = agent_mod.WizardClient(base_url=wizard_api.base_url).lookup_result("dumbledore").potions
+    with WizardAPIStub(chunk_size=32, chunk_delay=0.01) as slow:
+        client = agent_mod.WizardClient(base_url=slow.base_url, cache=agent_mod.LookupCache())
+        started = time.monotonic()
+        stream = client.iter_potions("dumbledore")
+        first = next(stream)
+        first_at = time.monotonic() - started
+        rows = [first, *stream]
+        total = time.monotonic() - started
+
+        assert rows == expected
+        assert first_at < total - 0.05  # the last wizards were still ~9 chunks away
+        before = len(slow.requests)
+        assert list(client.iter_potions("Dumbledore")) == rows  # complete stream was cached
+        assert len(slow.requests) == before
+
+        agent = agent_mod.HybridAgent(FakeLLMAgent(), client)
+        lines = [agent_mod.format_stream_item(item) for item in agent.stream("What is 12 * 7?")]
+        assert lines == ['{"answer":"llm: What is 12 * 7?"}']
+
+
+def test_half_open_probe_is_released_when_request_never_starts(wizard_api):
+    now = [0.0]
+    breaker = agent_mod.CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url, breaker=breaker)
+    breaker.record_failure()
+    now[0] = 11.0
+
+    expired = json.loads(client.lookup("Snape", deadline=time.monotonic() - 0.001))
+    assert "deadline" in expired["error"]
+    assert breaker.state == "half_open"
+    assert json.loads(client.lookup("Snape"))["potions"]
+    assert breaker.state == "closed"
+
+    breaker.record_failure()
+    now[0] = 30.0
+    assert breaker.before_call() is None
+    breaker.release()  # e.g. a cancelled attempt
+    assert breaker.before_call() is None
+
+
+def test_latency_samples_exclude_rate_limit_waits_and_streaming_consumers(wizard_api):
+    client = agent_mod.WizardClient(
+        base_url=wizard_api.base_url, rate_limiter=agent_mod.RateLimiter(rate=10, burst=1)
+    )
+    for _ in range(3):
+        client.get_json("/wizards", {"name": "Snape"}, limit=5)
+    assert client.rate_limiter.stats()["/wizards"]["delayed"] == 2
+    assert max(client.latency._samples) < 0.05
+
+    for _ in client.iter_json_array("/wizards", limit=5):
+        time.sleep(0.02)
+    assert len(client.latency._samples) == 3
+
+
+def test_concurrent_streams_share_one_request_and_unexpected_errors_fall_back(wizard_api):
+    from concurrent.futures import ThreadPoolExecutor
+    from tests.wizard_api_stub import WizardAPIStub
+
+    with WizardAPIStub(chunk_size=64, chunk_delay=0.01) as slow:
+        client = agent_mod.WizardClient(base_url=slow.base_url)
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(lambda _: list(client.iter_potions("Snape")), range(5)))
+        assert all(rows and rows == results[0] for rows in results)
+        assert len([r for r in slow.requests if r.startswith("/wizards")]) == 1
+        assert client.inflight.stats()["shared"] >= 1
+
+    def broken_body(query, deadline=None):
+        raise ValueError("response body is not a JSON array")
+        yield
+
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url, cache=agent_mod.LookupCache())
+    client.source.iter_wizards = broken_body
+    agent = agent_mod.HybridAgent(FakeLLMAgent(), client)
+    assert list(agent.stream("Snape")) == ["llm: Snape"]
+
+
+def test_async_lookup_keeps_disk_cache_io_off_the_event_loop(wizard_api, tmp_path):
+    import threading
+
+    disk = agent_mod.DiskLookupCache(str(tmp_path / "cache.sqlite3"))
+    threads = []
+    for name in ("get_stale", "set"):
+        original = getattr(disk, name)
+
+        def spy(*args, _original=original, **kwargs):
+            threads.append(threading.current_thread())
+            return _original(*args, **kwargs)
+
+        setattr(disk, name, spy)
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url, cache=agent_mod.LookupCache(), disk_cache=disk)
+
+    async def lookups():
+        loop_thread = threading.current_thread()
+        async_client = agent_mod.AsyncWizardClient(client)
+        first = await async_client.lookup_result("Snape")
+        second = await async_client.lookup_result("Snape")  # memory hit, no disk access
+        await async_client.aclose()
+        return loop_thread, first, second
+
+    loop_thread, first, second = asyncio.run(lookups())
+    assert first.potions and second.potions == first.potions
+    assert len(threads) == 2 and loop_thread not in threads
+
+
+def test_async_tool_and_clients_do_not_leak_connections_across_loops(stub_client):
+    import gc
+    import warnings
+
+    expected = json.loads(agent_mod.wizard_lookup.invoke({"query": "Snape"}))
+    assert json.loads(asyncio.run(agent_mod.wizard_lookup.ainvoke({"query": "Snape"}))) == expected
+
+    async_client = agent_mod.AsyncWizardClient(
+        agent_mod.WizardClient(base_url=stub_client.base_url, cache=agent_mod.LookupCache())
+    )
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        for _ in range(3):  # each run gets, and then closes, its own httpx client
+            assert asyncio.run(async_client.lookup_result("Dumbledore")).potions
+        assert async_client.source.search_wizards("Snape")  # sync path, no event loop
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+
+
+def test_lazy_executors_are_created_once_under_concurrency():
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = agent_mod.WizardClient(base_url="http://unused.test")
+    barrier = agent_mod.threading.Barrier(8)
+
+    def get(_):
+        barrier.wait()
+        return client._executor("_hydrate_executor", 2, "wizard-hydrate")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        executors = set(map(id, pool.map(get, range(8))))
+    assert executors == {id(client._hydrate_executor)}
+    client.close()
+
+
+def test_unknown_elixirs_are_cached_as_short_lived_misses():
+    from tests.wizard_api_stub import WizardAPIStub
+
+    dataset = {
+        "wizards": [
+            {"id": "w1", "firstName": "Albus", "lastName": "Dumbledore", "elixirs": [{"id": "gone", "name": "Lost"}]},
+        ],
+        "elixirs": [],
+    }
+    now = [0.0]
+    with WizardAPIStub(dataset=dataset) as stub:
+        elixir_cache = agent_mod.LookupCache(clock=lambda: now[0])
+        client = agent_mod.WizardClient(base_url=stub.base_url, hydrate=True, elixir_cache=elixir_cache)
+        for query in ("Albus", "Dumbledore"):
+            assert [p["potion_name"] for p in json.loads(client.lookup(query))["potions"]] == ["Lost"]
+        assert asyncio.run(agent_mod.AsyncWizardClient(client).lookup_result("Dumbled")).potions
+        assert stub.requests.count("/elixirs/gone") == 1
+
+        now[0] = agent_mod.ELIXIR_MISS_TTL + 1
+        client.lookup("Albu")
+        assert stub.requests.count("/elixirs/gone") == 2
+
+
+def test_error_responses_return_their_connection_to_the_pool():
+    import gc
+    import warnings
+    from tests.wizard_api_stub import WizardAPIStub
+
+    with WizardAPIStub(error_rate=1.0) as failing:
+        client = agent_mod.WizardClient(
+            base_url=failing.base_url, breaker=agent_mod.CircuitBreaker(failure_threshold=100)
+        )
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            for _ in range(5):
+                assert "API request failed" in json.loads(client.lookup("Snape"))["error"]
+            gc.collect()
+        pools = client._adapter.poolmanager.pools
+        (pool,) = [pools[key] for key in pools.keys()]
+        assert pool.num_requests > 5 and pool.num_connections == 1  # retries included
+        client.close()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+
+
+def test_flights_of_different_kinds_never_share_a_key(wizard_api):
+    client = agent_mod.WizardClient(base_url=wizard_api.base_url)
+    held = []
+    for key in [("elixir", "e1"), ("stream", "snape")]:
+        flight, leader = client.inflight.join(key)
+        assert leader
+        held.append((key, flight))
+    try:
+        # Queries spelled like another kind's key still run their own search
+        assert not client.lookup_result("elixir:e1").potions
+        assert list(client.iter_potions("stream:snape")) == []
+    finally:
+        for key, flight in held:
+            client.inflight.finish(key, flight)
+    assert client.lookup_result("snape").potions
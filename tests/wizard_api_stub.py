@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Wizard World API, for offline tests and benchmarks.
+
+Serves a fixture dataset on the same ``/wizards`` and ``/elixirs`` endpoints
+as the real API, with optional injected latency, error rate and slow-body
+streaming.
+
+Usage:
+  - Run: python tests/wizard_api_stub.py --port 8000 --latency lognormal:-2.5,0.8
+  - Point the agent at it: WIZARD_API_BASE=http://127.0.0.1:8000 python src/agent.py -q Snape
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURE_PATH = Path(__file__).resolve().parent / "fixtures" / "wizard_world.json"
+
+
+def load_fixture(path: Path = FIXTURE_PATH) -> dict:
+    """Load a ``{"wizards": [...], "elixirs": [...]}`` dataset."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_latency(spec: str, rng: random.Random) -> Callable[[], float]:
+    """Build a latency sampler (seconds) from a spec string.
+
+    Supported specs: ``fixed:S``, ``uniform:LO,HI``, ``exponential:MEAN`` and
+    ``lognormal:MU,SIGMA``.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "exponential":
+        return lambda: rng.expovariate(1 / values[0])
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def _matches(wizard: dict, needle: str) -> bool:
+    for field in ("firstName", "lastName"):
+        value = wizard.get(field)
+        if value and needle in value.casefold():
+            return True
+    return False
+
+
+class WizardAPIStub:
+    """Threaded HTTP server answering like the Wizard World API.
+
+    Args:
+        dataset: Fixture with ``wizards`` and ``elixirs`` lists.
+        latency: Callable returning the delay (seconds) before each response.
+        error_rate: Probability of answering 503 instead of the payload.
+        chunk_size: When set, bodies are sent with chunked encoding in pieces
+            of this many bytes.
+        chunk_delay: Pause between body chunks, to simulate a slow transfer.
+        seed: Seed for the latency and error random number generator.
+    """
+
+    def __init__(
+        self,
+        dataset: Optional[dict] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: Optional[Callable[[], float]] = None,
+        error_rate: float = 0.0,
+        chunk_size: Optional[int] = None,
+        chunk_delay: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.dataset = dataset if dataset is not None else load_fixture()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests: list = []
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "WizardAPIStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve in the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "WizardAPIStub":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def route(self, path: str, query: dict) -> tuple:
+        """Return ``(status, payload)`` for a GET request."""
+        parts = [p for p in path.lower().split("/") if p]
+        if not parts or parts[0] not in ("wizards", "elixirs"):
+            return 404, {"title": "Not Found", "status": 404}
+        records = self.dataset[parts[0]]
+        if len(parts) == 2:
+            for record in records:
+                if record.get("id") == parts[1]:
+                    return 200, record
+            return 404, {"title": "Not Found", "status": 404}
+        name = (query.get("name") or query.get("Name") or [""])[0].casefold()
+        if parts[0] == "wizards" and name:
+            records = [w for w in records if _matches(w, name)]
+        elif name:
+            records = [e for e in records if name in (e.get("name") or "").casefold()]
+        return 200, records
+
+    def _handler_class(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                url = urlsplit(self.path)
+                with stub._lock:
+                    stub.requests.append(self.path)
+                    fail = stub.rng.random() < stub.error_rate
+                    delay = stub.latency() if stub.latency else 0.0
+                if delay > 0:
+                    time.sleep(delay)
+                if fail:
+                    status, payload = 503, {"title": "Service Unavailable", "status": 503}
+                else:
+                    status, payload = stub.route(url.path, parse_qs(url.query))
+                self._send(status, json.dumps(payload).encode("utf-8"))
+
+            def do_HEAD(self) -> None:
+                with stub._lock:
+                    stub.requests.append(f"HEAD {self.path}")
+                status, _payload = stub.route(urlsplit(self.path).path, {})
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _send(self, status: int, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                if not stub.chunk_size:
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for start in range(0, len(body), stub.chunk_size):
+                        chunk = body[start:start + stub.chunk_size]
+                        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                        self.wfile.flush()
+                        if stub.chunk_delay:
+                            time.sleep(stub.chunk_delay)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # client stopped reading early
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local Wizard World API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fixture", type=Path, default=FIXTURE_PATH, help="Dataset JSON file")
+    parser.add_argument("--latency", help="Latency spec, e.g. fixed:0.2 or lognormal:-2.5,0.8")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 503 responses")
+    parser.add_argument("--chunk-size", type=int, help="Stream bodies in chunks of this many bytes")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between body chunks")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stub = WizardAPIStub(
+        load_fixture(args.fixture),
+        host=args.host,
+        port=args.port,
+        latency=parse_latency(args.latency, rng) if args.latency else None,
+        error_rate=args.error_rate,
+        chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay,
+        seed=args.seed,
+    )
+    print(f"Serving Wizard World stand-in on {stub.base_url} (Ctrl+C to stop)")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()